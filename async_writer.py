@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset, date2num
+from xarray.backends.netCDF4_ import NETCDF4_PYTHON_LOCK
+import logging
+
+# Asynchronous output writer. When the OpenDrift export buffer is full, a copy
+# of it is put into a bounded queue and written to the NetCDF file by a
+# background thread while the next steps are computed. The queue bounds the
+# memory used by pending buffers, the model only waits if it is full.
+WRITER_QUEUE = 2
+
+
+def netcdf_encoding(result):
+    # Same encoding as opendrift.export.io_netcdf, dtype attributes are removed from the result
+    encoding = {'trajectory': {'dtype': result.trajectory.attrs['dtype'], '_FillValue': None},
+                'time': {'units': 'seconds since 1970-01-01 00:00:00',
+                         'dtype': result.time.attrs['dtype'], '_FillValue': None}}
+    for varname, var in result.variables.items():
+        attrs = var.attrs.copy()
+        if varname not in ['time', 'trajectory'] and 'dtype' in attrs and issubclass(attrs['dtype'], np.integer):
+            encoding[varname] = {'dtype': attrs['dtype'], '_FillValue': np.iinfo(attrs['dtype']).max}
+        attrs.pop('dtype', None)
+        result[varname].attrs = attrs
+    return encoding
+
+
+def write_netcdf_buffer(filename, buffer, encoding=None):
+    if encoding is not None:  # first buffer creates the file
+        buffer.to_netcdf(filename, unlimited_dims={'time': True}, encoding=encoding)
+        return
+    # Readers may access netCDF files from the main thread, the library is not thread safe
+    with NETCDF4_PYTHON_LOCK:
+        with Dataset(filename, 'a') as nc:
+            numtimes = nc['time'].shape[0]
+            for varname in buffer.data_vars:
+                if 'time' in buffer[varname].dims:
+                    nc.variables[varname][:, numtimes:numtimes + buffer.sizes['time']] = buffer[varname].values
+            nc.variables['time'][numtimes:numtimes + buffer.sizes['time']] = \
+                date2num(pd.to_datetime(buffer.time.values).to_pydatetime(), nc['time'].units, nc['time'].calendar)
+
+
+class BufferWriter:
+    def __init__(self, maxsize=WRITER_QUEUE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.latency = []
+        self.depth = []
+        self.error = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def put(self, filename, buffer, encoding=None):
+        if self.error is not None:
+            raise self.error
+        self.depth.append(self.queue.qsize())
+        self.queue.put((filename, buffer, encoding))  # waits only if the queue is full
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def statistics(self):
+        return {'buffers': len(self.latency),
+                'max_queue_depth': int(np.max(self.depth)) if self.depth else 0,
+                'mean_write_latency': float(np.mean(self.latency)) if self.latency else 0.0,
+                'max_write_latency': float(np.max(self.latency)) if self.latency else 0.0}
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # keep draining, the error is raised in the main thread
+            start = time.perf_counter()
+            try:
+                write_netcdf_buffer(*item)
+            except Exception as e:
+                self.error = e
+            self.latency.append(time.perf_counter() - start)
+
+
+class AsyncWriterMixin:
+    writer_queue = WRITER_QUEUE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writer = None
+        self.io_write_buffer = self.async_write_buffer
+        self.io_close_sync = self.io_close
+        self.io_close = self.async_close
+
+    def async_write_buffer(self):
+        encoding = None
+        if self.writer is None:
+            self.writer = BufferWriter(self.writer_queue)
+            encoding = netcdf_encoding(self.result)
+            self._netCDF_encoding = encoding
+        # Buffer is reset by the model after this call, the writer gets a copy
+        self.writer.put(self.outfile_name, self.result.copy(deep=True), encoding)
+
+    def async_close(self):
+        if self.writer is not None:
+            self.writer.close()
+            stats = self.writer.statistics()
+            logging.info(f"Async writer: {stats['buffers']} buffers, max queue depth {stats['max_queue_depth']}, "
+                         f"write latency mean {stats['mean_write_latency']:.3f} s, max {stats['max_write_latency']:.3f} s.")
+        self.io_close_sync()
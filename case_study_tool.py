@@ -12,8 +12,14 @@ import os
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import copernicusmarine
+import geopandas as gpd
 from opendrift.readers.reader_netCDF_CF_generic import Reader
 import logging
+from stream_tool import SnapshotStreamer, StreamMixin
+from tiled_forcing import tile_datasets
+from async_writer import AsyncWriterMixin
+from fast_drift import fast_simulation
+from memory_reader import create_readers, MEMORY_READER_GB
 
 # logging.basicConfig(
 #     level=logging.INFO,
@@ -312,6 +318,205 @@ def seed(o, model, lw_obj, start_position, start_t, num, rad, ship, wdf, seed_ty
     
     return o
 
+# Seeding from file. Each row of the file is one release point, optional columns
+# override the defaults from the configuration for that point.
+SEED_BATCH_SIZE = 100000
+SEED_FILE_ALIASES = {'latitude': 'lat', 'longitude': 'lon', 'rad': 'radius',
+                     'release_time': 'time', 'lw_obj': 'object_type'}
+SEED_FILE_PROPERTIES = {'OceanDrift': ['wdf'],
+                        'Leeway': ['object_type'],
+                        'ShipDrift': ['length', 'beam', 'height', 'draft']}
+
+def read_seed_file(seed_file):
+    ext = os.path.splitext(seed_file)[1].lower()
+    if ext == '.csv':
+        df = pd.read_csv(seed_file)
+    elif ext == '.parquet':
+        df = pd.read_parquet(seed_file)
+    elif ext in ['.geojson', '.json']:
+        gdf = gpd.read_file(seed_file)
+        df = pd.DataFrame(gdf.drop(columns='geometry'))
+        df['lon'] = gdf.geometry.x.values
+        df['lat'] = gdf.geometry.y.values
+    else:
+        logging.error(f'Unsupported seed file format: {ext}')
+        return pd.DataFrame()
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df.rename(columns=SEED_FILE_ALIASES)
+
+def load_seed_file(seed_file, model, start_t, rad=0, ship=[62, 8, 10, 5], wdf=0.02, lw_obj=1, copies=1,
+                   end_t=None):
+    df = read_seed_file(seed_file)
+    if 'lat' not in df.columns or 'lon' not in df.columns:
+        logging.error(f'Seed file {seed_file} must contain lat and lon columns.')
+        return pd.DataFrame()
+
+    # Per-element wdf lists belong to start_position seeding, seed files give wdf per row
+    if isinstance(wdf, bool) or not isinstance(wdf, (int, float)):
+        logging.warning(f'Wind drift factor {wdf} cannot be used with seed file, use a wdf column instead. '
+                        f'Using default value 0.02 for rows without wdf.')
+        wdf = 0.02
+
+    # Fill missing columns with configuration values
+    length, beam, height, draft = ship
+    start_t = PrepareStartTime(start_t)
+    defaults = {'time': start_t,
+                'radius': rad if isinstance(rad, (int, float)) else 0,
+                'number': 1, 'wdf': wdf, 'object_type': lw_obj,
+                'length': length, 'beam': beam, 'height': height, 'draft': draft}
+    columns = ['lat', 'lon', 'time', 'radius', 'number'] + SEED_FILE_PROPERTIES[model]
+    for key in columns[2:]:
+        if key not in df.columns:
+            df[key] = defaults[key]
+        elif key != 'time':
+            df[key] = pd.to_numeric(df[key], errors='coerce').fillna(defaults[key])
+    df = df[columns]
+    df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
+    df['lon'] = pd.to_numeric(df['lon'], errors='coerce')
+    # Empty release times fall back to start_t, only unparsable values are invalid
+    empty = df['time'].isna() | (df['time'].astype(str).str.strip() == '')
+    df['time'] = pd.to_datetime(df['time'].where(~empty), errors='coerce', utc=True).dt.tz_localize(None)
+    df.loc[empty, 'time'] = pd.to_datetime(start_t)
+
+    # Vectorized validation, invalid rows are dropped
+    rules = {
+        'Missing or invalid coordinates': df['lat'].isna() | df['lon'].isna(),
+        'Latitude outside [-90, 90]': ~df['lat'].between(-90, 90),
+        'Longitude outside [-180, 180]': ~df['lon'].between(-180, 180),
+        'Invalid release time': df['time'].isna(),
+        'Negative radius': df['radius'] < 0,
+        'Number of elements below 1': df['number'] < 1,
+    }
+    # Elements released outside the simulation period would never be released
+    if end_t is not None:
+        first, last = sorted([pd.to_datetime(start_t), pd.to_datetime(PrepareEndTime(end_t))])
+        rules['Release time outside simulation period'] = df['time'].notna() & ~df['time'].between(first, last)
+    if model == 'OceanDrift':
+        rules['Wind drift factor outside [0, 1]'] = ~df['wdf'].between(0, 1)
+    elif model == 'Leeway':
+        rules['Leeway object outside [1, 85]'] = ~df['object_type'].between(1, 85)
+    elif model == 'ShipDrift':
+        rules['Non-positive ship dimensions'] = (df[['length', 'beam', 'height', 'draft']] <= 0).any(axis=1)
+
+    invalid = np.zeros(len(df), dtype=bool)
+    for error, mask in rules.items():
+        mask = mask.to_numpy()
+        if mask.any():
+            logging.warning(f'{error} in {mask.sum()} rows of {seed_file}. Rows are skipped.')
+        invalid |= mask
+    df = df[~invalid]
+
+    # Rows may release several elements at the same point and time,
+    # copies > 1 duplicates every element (e.g. once per ensemble member)
+    df = df.loc[df.index.repeat(df['number'].astype(int) * copies)].reset_index(drop=True)
+    logging.info(f'Seed file {seed_file}: {len(df)} elements from {(~invalid).sum()} valid rows.')
+    return df.drop(columns='number')
+
+def seed_from_file(o, model, seed_file, start_t, rad, ship, wdf, lw_obj, orientation,
+                   batch_size=SEED_BATCH_SIZE, copies=1, end_t=None):
+    name = [key for key, value in model_dict.items() if value == model][0]
+    df = load_seed_file(seed_file, name, start_t, rad=rad, ship=ship, wdf=wdf, lw_obj=lw_obj, copies=copies,
+                        end_t=end_t)
+    if len(df) == 0:
+        logging.error(f'No valid elements in seed file {seed_file}.')
+        return o
+
+    if model == ShipDrift:
+        o.set_config('seed:orientation', orientation)
+    # Leeway accepts a single object type per seeding call
+    groups = df.groupby('object_type') if model == Leeway else [(None, df)]
+    for obj, group in groups:
+        for i in range(0, len(group), batch_size):
+            batch = group.iloc[i:i + batch_size]
+            kwargs = dict(lat=batch['lat'].to_numpy(), lon=batch['lon'].to_numpy(),
+                          time=batch['time'].dt.to_pydatetime(), radius=batch['radius'].to_numpy(),
+                          number=len(batch))
+            if model == OceanDrift:
+                o.seed_elements(wind_drift_factor=batch['wdf'].to_numpy(), **kwargs)
+            elif model == Leeway:
+                o.seed_elements(object_type=int(obj), **kwargs)
+            elif model == ShipDrift:
+                o.seed_elements(length=batch['length'].to_numpy(), beam=batch['beam'].to_numpy(),
+                                height=batch['height'].to_numpy(), draft=batch['draft'].to_numpy(), **kwargs)
+    return o
+
+# Ensemble mode. Elements are split into members by ID (member = ID % members),
+# forcing of each member is perturbed after interpolation, so all members share
+# a single pass of reader access and interpolation.
+ENSEMBLE_FORCING = {'current': ('x_sea_water_velocity', 'y_sea_water_velocity'),
+                    'wind': ('x_wind', 'y_wind')}
+
+def ensemble_perturbations(members, current=None, wind=None, seed=None):
+    rng = np.random.default_rng(seed)
+    perturbations = {'members': members}
+    for forcing, settings in {'current': current, 'wind': wind}.items():
+        settings = settings or {}
+        scale = 1 + rng.normal(0, settings.get('scale', 0), members)
+        rotation = rng.normal(0, settings.get('rotation', 0), members)
+        x_offset = rng.normal(0, settings.get('offset', 0), members)
+        y_offset = rng.normal(0, settings.get('offset', 0), members)
+        # Member 0 is the unperturbed control run
+        scale[0], rotation[0], x_offset[0], y_offset[0] = 1, 0, 0, 0
+        perturbations[forcing] = {'scale': scale, 'rotation': rotation,
+                                  'x_offset': x_offset, 'y_offset': y_offset}
+    return perturbations
+
+class EnsembleMixin:
+    ensemble = None
+
+    def prepare_run(self):
+        super().prepare_run()
+        members = self.ensemble['members']
+        self.result['ensemble_member'] = xr.DataArray(
+            (self.result.trajectory.values % members).astype(np.int32), dims='trajectory',
+            attrs={'long_name': 'ensemble member index'})
+        self.add_metadata('ensemble_members', members)
+        for forcing in ENSEMBLE_FORCING:
+            for key, values in self.ensemble[forcing].items():
+                self.add_metadata(f'ensemble_{forcing}_{key}', np.round(values, 6).tolist())
+        # Every environment fetch for the elements is perturbed, including the
+        # intermediate Runge-Kutta stages of the advection
+        get_environment = self.env.get_environment
+        depth = [0]
+
+        def perturbed_environment(variables, time, lon, lat, z, *args, **kwargs):
+            depth[0] += 1  # Environment calls itself when falling back to other readers
+            try:
+                env, env_profiles, missing = get_environment(variables, time, lon, lat, z, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+            if depth[0] == 0 and np.size(lon) == len(self.elements.ID):
+                self.perturb_environment(env)
+            return env, env_profiles, missing
+
+        self.env.get_environment = perturbed_environment
+
+    def perturb_environment(self, env):
+        member = self.elements.ID % self.ensemble['members']
+        for forcing, (x_var, y_var) in ENSEMBLE_FORCING.items():
+            if x_var not in env.dtype.names or y_var not in env.dtype.names:
+                continue
+            p = self.ensemble[forcing]
+            angle = np.radians(p['rotation'][member])
+            u = env[x_var].copy()
+            v = env[y_var].copy()
+            env[x_var] = p['scale'][member] * (u * np.cos(angle) - v * np.sin(angle)) + p['x_offset'][member]
+            env[y_var] = p['scale'][member] * (u * np.sin(angle) + v * np.cos(angle)) + p['y_offset'][member]
+
+def ensemble_statistics(result):
+    # Per member and time: mean position and spread (std) of the elements
+    grouped = result[['lon', 'lat']].groupby(result['ensemble_member'].astype(np.int32))
+    mean = grouped.mean(dim='trajectory', skipna=True)
+    std = grouped.std(dim='trajectory', skipna=True)
+    return xr.merge([mean, std.rename({'lon': 'lon_std', 'lat': 'lat_std'})])
+
+def make_model(model, mixins):
+    if not mixins:
+        return model
+    # Keep name and module of the base model, written to the output as
+    # opendrift_class/opendrift_module and used by opendrift.open
+    return type(model.__name__, (*mixins, model), {'__module__': model.__module__})
+
 model_dict = {'OceanDrift':OceanDrift,
               'Leeway':Leeway,
               'ShipDrift':ShipDrift}
@@ -320,11 +525,13 @@ def simulation(lw_obj=1, model='OceanDrift', start_position=None, start_t=None,
                end_t=None, datasets=None, std_names=None, num=100,
                rad=0, ship=[62, 8, 10, 5], wdf=0.02, orientation = 'random',
                delay=False, multi_rad=False, seed_type=None, time_step = None,
-               configurations = None, file_name = None, vocabulary = None):
+               configurations = None, file_name = None, vocabulary = None,
+               seed_file = None, ensemble = None, stream = None, adaptive_forcing = None,
+               async_writer = None, engine = None, memory_reader = None):
     
     # Check main requirments
-    if start_position == None:
-        logging.error('Start position is required')
+    if start_position == None and seed_file == None:
+        logging.error('Start position or seed file is required')
         return
     if datasets == None:
         logging.error('At least one dataset is required')
@@ -337,11 +544,16 @@ def simulation(lw_obj=1, model='OceanDrift', start_position=None, start_t=None,
     model = model_dict[model]   
     
     
-    # Create readers
-    if type(datasets) == list:
-        reader = [Reader(ds, standard_name_mapping=std_names) for ds in datasets]
-    else:
-        reader = Reader(datasets, standard_name_mapping=std_names)
+    # Load forcing only in tiles around the particles
+    if adaptive_forcing is not None:
+        datasets, tile_cache = tile_datasets(datasets, **adaptive_forcing)
+
+    # Create readers. Forcing under the footprint threshold (GB) is loaded into memory,
+    # tiled forcing and the fast engine keep the lazy datasets
+    threshold = MEMORY_READER_GB if memory_reader is None else memory_reader
+    if threshold == 0 or adaptive_forcing is not None or (engine is not None and engine.startswith('fast')):
+        threshold = None
+    reader = create_readers(datasets, std_names, start_t, end_t, threshold, list(model.required_variables))
         
     # Prepare start and end times
     start_t = PrepareStartTime(start_t, reader)
@@ -366,20 +578,63 @@ def simulation(lw_obj=1, model='OceanDrift', start_position=None, start_t=None,
             
     os.makedirs(output_dir, exist_ok=True)    
     file_name = os.path.join(output_dir, file_name)
+
+    # Fast-path screening run, no OpenDrift model is created
+    if engine is not None and engine.startswith('fast'):
+        if model != OceanDrift:
+            logging.error(f'Engine {engine} supports only OceanDrift.')
+            return
+        configurations = configurations or {}
+        return fast_simulation(start_position=start_position, start_t=start_t, end_t=end_t,
+                               datasets=datasets, std_names=std_names, num=num, rad=rad, wdf=wdf,
+                               seed_type=seed_type, time_step=time_step or 3600, file_name=file_name,
+                               scheme=engine.split('-')[-1],
+                               diffusivity=configurations.get('drift:horizontal_diffusivity', 0),
+                               landmask=configurations.get('general:use_auto_landmask', True))
     # Create a model and add readers
-    o = model(loglevel = 50)
+    mixins = []
+    copies = 1
+    if ensemble is not None:
+        mixins.append(EnsembleMixin)
+        copies = ensemble['members']
+        num = num * copies
+        if isinstance(wdf, list):
+            wdf = np.repeat(wdf, copies)
+    if stream is not None:
+        mixins.append(StreamMixin)
+    if async_writer is not None:
+        mixins.append(AsyncWriterMixin)
+    o = make_model(model, mixins)(loglevel = 50)
+    if async_writer is not None:
+        o.writer_queue = async_writer.get('queue', o.writer_queue)
+    if ensemble is not None:
+        o.ensemble = ensemble_perturbations(**ensemble)
     if configurations is not None:
         for key, value in configurations.items():
             o.set_config(key, value)
     o.add_reader(reader)
     # Seed
-
-    o = seed(o=o, model=model, lw_obj=lw_obj, num = num, rad = rad, start_t = start_t, 
-             start_position=start_position, ship=ship, wdf = wdf, seed_type=seed_type, orientation=orientation)
-    # Run
-    if time_step is None:
-        o.run(end_time=end_t, outfile = file_name)
+    if seed_file is not None:
+        o = seed_from_file(o=o, model=model, seed_file=seed_file, start_t=start_t, rad=rad,
+                           ship=ship, wdf=wdf, lw_obj=lw_obj, orientation=orientation, copies=copies,
+                           end_t=end_t)
     else:
-        o.run(end_time=end_t, time_step=time_step, time_step_output=time_step, outfile = file_name)
+        o = seed(o=o, model=model, lw_obj=lw_obj, num = num, rad = rad, start_t = start_t, 
+                 start_position=start_position, ship=ship, wdf = wdf, seed_type=seed_type, orientation=orientation)
+    # Run
+    if stream is not None:
+        o.streamer = SnapshotStreamer(**stream).start(model=model.__name__, file_name=file_name,
+                                                      start_t=str(start_t), end_t=str(end_t))
+    try:
+        if time_step is None:
+            o.run(end_time=end_t, outfile = file_name)
+        else:
+            o.run(end_time=end_t, time_step=time_step, time_step_output=time_step, outfile = file_name)
+    finally:
+        if stream is not None:
+            o.streamer.close()
+    if adaptive_forcing is not None:
+        logging.info(f'Adaptive forcing loaded {len(tile_cache.tiles)} tiles, '
+                     f'{tile_cache.loaded_bytes / 1e6:.1f} MB.')
             
     return o
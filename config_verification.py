@@ -12,10 +12,17 @@ logging.basicConfig(
 
 SIMULATION_KEYS = ['lw_obj', 'model', 'start_position', 'start_t', 'end_t',
                   'num', 'rad', 'ship', 'wdf', 'orientation', 'seed_type',
-                  'time_step', 'configurations', 'file_name', 'vocabulary', 'backtracking']
+                  'time_step', 'configurations', 'file_name', 'vocabulary', 'backtracking',
+                  'seed_file', 'ensemble', 'stream', 'adaptive_forcing', 'async_writer', 'engine', 'memory_reader']
 DATASET_KEYS = ['start_t', 'end_t', 'border', 'folder', 'concatenation',  'copernicus', 'user', 'pword']
+PLAN_KEYS = ['limits']
+LIMIT_KEYS = ['download_gb', 'memory_gb', 'output_gb', 'runtime_h']
 REQUIRED_KEYS = ['model','start_position', 'start_t', 'end_t']
 VOC = ["Copernicus", "ECMWF", "Copernicus_edited"]
+ENSEMBLE_PERTURBATIONS = ['scale', 'rotation', 'offset']
+ENGINES = ['opendrift', 'fast-rk2', 'fast-rk4']
+FAST_ENGINE_UNSUPPORTED = ['seed_file', 'ensemble', 'stream', 'adaptive_forcing', 'async_writer']
+SEED_FILE_TYPES = ['.csv', '.geojson', '.json', '.parquet']
 CHECK = True
 # Help functions
 def verify_border(border):
@@ -78,6 +85,17 @@ def check_seed_settings(flag, file, sim_vars):
     st = file.get('seed_type')
     num = file.get('num')
     rad = file.get('rad')
+
+    # Positions and element numbers come from the seed file (ensemble copies every row),
+    # rad is only the default radius of rows without a radius column
+    if 'seed_file' in sim_vars:
+        if rad is not None:
+            if isinstance(rad, int) and check_rad(rad):
+                sim_vars["rad"] = rad
+            else:
+                logging.error(f"Incorrect rad: {rad} for seed_file. Using default rad=0.")
+        return flag, sim_vars
+
     pos = np.array(file.get("start_position", []))
     shape = pos.shape
 
@@ -243,6 +261,213 @@ def check_position_settings(flag, file, sim_vars):
     return flag, sim_vars
 
 
+# Seed file settings. Only the path and format are checked here, the content is
+# validated row-wise (vectorized) when the file is loaded for seeding.
+def check_seed_file(flag, file, sim_vars):
+    if not flag:
+        return flag, sim_vars
+    val = file.get('seed_file')
+    if val is None:
+        return flag, sim_vars
+
+    if not isinstance(val, str) or not os.path.isfile(val):
+        logging.error(f"Invalid or missing seed_file: {val}. Must be a path to an existing file.")
+        return False, sim_vars
+
+    ext = os.path.splitext(val)[1].lower()
+    if ext not in SEED_FILE_TYPES:
+        logging.error(f"Unsupported seed_file format: {ext}. Must be one of {SEED_FILE_TYPES}.")
+        return False, sim_vars
+
+    if isinstance(file.get('wdf'), list):
+        logging.error("Wind drift factor list cannot be combined with seed_file. Use a wdf column in the seed file.")
+        return False, sim_vars
+
+    if file.get('start_position') is not None:
+        logging.warning("Both seed_file and start_position are given. Positions from seed_file are used.")
+    sim_vars['seed_file'] = val
+    logging.info('Seed file settings verified, success!')
+    return flag, sim_vars
+
+
+# Ensemble settings. Invalid perturbations are dropped, invalid member count disables ensemble mode.
+def check_ensemble_settings(file, sim_vars):
+    ens = file.get('ensemble')
+    if ens is None:
+        return sim_vars
+    if not isinstance(ens, dict) or not isinstance(ens.get('members'), int) or ens['members'] < 1:
+        logging.warning(f"Invalid ensemble: {ens}. Must be a dictionary with positive integer members. Skipping ensemble.")
+        return sim_vars
+
+    ensemble = {'members': ens['members']}
+    seed = ens.get('seed')
+    if seed is not None:
+        if isinstance(seed, int) and seed >= 0:
+            ensemble['seed'] = seed
+        else:
+            logging.warning(f"Invalid ensemble seed: {seed}. Must be non-negative integer. Using random seed.")
+    for forcing in ['current', 'wind']:
+        settings = ens.get(forcing)
+        if settings is None:
+            continue
+        if not isinstance(settings, dict):
+            logging.warning(f"Invalid ensemble {forcing} perturbation: {settings}. Must be a dictionary. Skipping.")
+            continue
+        ensemble[forcing] = {}
+        for key, val in settings.items():
+            if key in ENSEMBLE_PERTURBATIONS and isinstance(val, (int, float)) and val >= 0:
+                ensemble[forcing][key] = val
+            else:
+                logging.warning(f"Invalid ensemble {forcing} perturbation {key}: {val}. "
+                                f"Must be one of {ENSEMBLE_PERTURBATIONS} with non-negative value. Skipping.")
+
+    unknown = set(ens.keys()) - {'members', 'seed', 'current', 'wind'}
+    if len(unknown) > 0:
+        logging.warning(f"Unknown ensemble keys: {list(unknown)}")
+    sim_vars['ensemble'] = ensemble
+    logging.info('Ensemble settings verified, success!')
+    return sim_vars
+
+
+# Stream settings. Given as target string or dictionary, invalid settings disable streaming.
+def check_stream_settings(file, sim_vars):
+    val = file.get('stream')
+    if val is None:
+        return sim_vars
+    if isinstance(val, str):
+        val = {'target': val}
+    rules = {
+        "target": {
+            "valid": lambda v: isinstance(v, str) and len(v) > 0,
+            "error": "Invalid or missing stream target: {}. Must be non-empty string. Skipping streaming.",
+        },
+        "buffer": {
+            "valid": lambda v: v is None or (isinstance(v, int) and v > 0),
+            "error": "Invalid stream buffer: {}. Must be positive integer. Skipping streaming.",
+        },
+        "abort_file": {
+            "valid": lambda v: v is None or isinstance(v, str),
+            "error": "Invalid stream abort_file: {}. Must be string. Skipping streaming.",
+        },
+    }
+    if not isinstance(val, dict):
+        logging.warning(f"Invalid stream: {val}. Must be string or dictionary. Skipping streaming.")
+        return sim_vars
+    for key, rule in rules.items():
+        if not rule["valid"](val.get(key)):
+            logging.warning(rule["error"].format(val.get(key)))
+            return sim_vars
+    sim_vars['stream'] = {key: v for key, v in val.items() if key in rules and v is not None}
+    logging.info('Stream settings verified, success!')
+    return sim_vars
+
+
+# Adaptive forcing settings. True enables default settings, invalid values fall back to defaults.
+def check_adaptive_forcing(file, sim_vars):
+    val = file.get('adaptive_forcing')
+    if val is None or val is False:
+        return sim_vars
+    if val is True:
+        val = {}
+    if not isinstance(val, dict):
+        logging.warning(f"Invalid adaptive_forcing: {val}. Must be True or dictionary. Skipping adaptive forcing.")
+        return sim_vars
+    rules = {
+        "max_speed": lambda v: isinstance(v, (int, float)) and v > 0,
+        "lookahead": lambda v: isinstance(v, int) and v >= 0,
+        "tile_size": lambda v: isinstance(v, int) and v > 0,
+    }
+    settings = {}
+    for key, v in val.items():
+        if key in rules and rules[key](v):
+            settings[key] = v
+        else:
+            logging.warning(f"Invalid adaptive_forcing {key}: {v}. Using default value.")
+    sim_vars['adaptive_forcing'] = settings
+    return sim_vars
+
+
+# Async writer settings. True enables default queue size.
+def check_async_writer(file, sim_vars):
+    val = file.get('async_writer')
+    if val is None or val is False:
+        return sim_vars
+    if val is True:
+        val = {}
+    if not isinstance(val, dict):
+        logging.warning(f"Invalid async_writer: {val}. Must be True or dictionary. Writing output synchronously.")
+        return sim_vars
+    settings = {}
+    q = val.get('queue')
+    if q is not None:
+        if isinstance(q, int) and q > 0:
+            settings['queue'] = q
+        else:
+            logging.warning(f"Invalid async_writer queue: {q}. Must be positive integer. Using default value 2.")
+    sim_vars['async_writer'] = settings
+    return sim_vars
+
+
+# Engine settings. The fast engine supports only plain OceanDrift surface runs.
+def check_engine(flag, file, sim_vars):
+    if not flag:
+        return flag, sim_vars
+    val = file.get('engine')
+    if val is None or val == 'opendrift':
+        return flag, sim_vars
+    if val not in ENGINES:
+        logging.warning(f"Invalid engine: {val}. Must be one of {ENGINES}. Using default engine opendrift.")
+        return flag, sim_vars
+    if file.get('model') != 'OceanDrift':
+        logging.error(f"Engine {val} supports only model OceanDrift.")
+        return False, sim_vars
+    unsupported = [key for key in FAST_ENGINE_UNSUPPORTED if key in sim_vars]
+    if len(unsupported) > 0:
+        logging.error(f"Engine {val} does not support {unsupported}.")
+        return False, sim_vars
+    sim_vars['engine'] = val
+    return flag, sim_vars
+
+
+# Memory reader threshold in GB of float32 forcing, 0 disables the memory reader.
+def check_memory_reader(file, sim_vars):
+    val = file.get('memory_reader')
+    if val is None:
+        return sim_vars
+    if isinstance(val, (int, float)) and not isinstance(val, bool) and val >= 0:
+        sim_vars['memory_reader'] = val
+    else:
+        logging.warning(f"Invalid memory_reader: {val}. Must be non-negative number. Using default threshold 1 GB.")
+    return sim_vars
+
+
+# Planning limits, checked by the planner before the run. Missing limits use planner defaults.
+def check_limits(file):
+    val = file.get('limits')
+    limits = {}
+    if val is None:
+        return limits
+    if not isinstance(val, dict):
+        logging.warning(f"Invalid limits: {val}. Must be a dictionary. Using default limits.")
+        return limits
+    for key, v in val.items():
+        if key in LIMIT_KEYS and isinstance(v, (int, float)) and v > 0:
+            limits[key] = v
+        else:
+            logging.warning(f"Invalid limit {key}: {v}. Must be one of {LIMIT_KEYS} with positive value. Using default.")
+    return limits
+
+
+def verify_limits(file_path):
+    try:
+        with open(file_path, 'r') as f:
+            config = json.load(f)
+    except:
+        logging.error('Unable to read or parse the configuration file.')
+        return {}
+    return check_limits(config)
+
+
 def check_data_settings(file, data_vars):
     rules = {
         "border": {
@@ -303,10 +528,16 @@ def verify_config_file(file_path):
         logging.error('Unable to read or parse the configuration file.')
         return False, sim_vars, data_vars
     
-    if all(key in config.keys() for key in REQUIRED_KEYS):
+    # start_position is not required when positions are read from seed_file
+    required = [key for key in REQUIRED_KEYS
+                if not (key == 'start_position' and 'seed_file' in config)]
+    if all(key in config.keys() for key in required):
         sim_vars['model'] = config['model']
         # parse the flag on each step, to avoid unncecary checkups if something failed
-        flag, sim_vars = check_position_settings(flag, config, sim_vars)
+        if 'seed_file' in config:
+            flag, sim_vars = check_seed_file(flag, config, sim_vars)
+        else:
+            flag, sim_vars = check_position_settings(flag, config, sim_vars)
         flag, sim_vars, data_vars = check_time_settings(flag, config, sim_vars, data_vars)
         flag, sim_vars  = check_seed_settings(flag, config, sim_vars)           # if incorrect, fall back to defaults, do not raise an error. Flag just for skipping. 
         data_vars = check_data_settings(config, data_vars)          # simulation can run with empty [] dataset, that will not raise an error
@@ -321,6 +552,13 @@ def verify_config_file(file_path):
                 logging.error(f"Unknown model type: {config['model']}")
                 flag = False
                 
+        sim_vars = check_ensemble_settings(config, sim_vars)
+        sim_vars = check_stream_settings(config, sim_vars)
+        sim_vars = check_adaptive_forcing(config, sim_vars)
+        sim_vars = check_async_writer(config, sim_vars)
+        sim_vars = check_memory_reader(config, sim_vars)
+        flag, sim_vars = check_engine(flag, config, sim_vars)
+
         name = config.get('file_name')
         if name is not None:
             sim_vars['file_name'] = name
@@ -344,7 +582,7 @@ def verify_config_file(file_path):
     else:
         logging.error('Missing required keys in the configuration file.')
             
-    residuals = unknown_keys(config, SIMULATION_KEYS, DATASET_KEYS)    
+    residuals = unknown_keys(config, SIMULATION_KEYS + PLAN_KEYS, DATASET_KEYS)    
     if len(residuals)>0:
         logging.warning(f"Unknown keys in configuration file: {residuals}")
         
@@ -0,0 +1,354 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyproj
+import xarray as xr
+from scipy import ndimage
+from async_writer import netcdf_encoding, write_netcdf_buffer
+from tiled_forcing import dim_kind
+import logging
+
+# Fast-path surface advection for OceanDrift screening runs.
+# Elements are advected with current + wdf * wind by a NumPy-vectorized
+# Runge-Kutta scheme over the prepared xarray forcing (bilinear in space,
+# linear in time), with optional random walk diffusion and stranding on the
+# auto landmask. No vertical processes, Stokes drift or reader fallbacks
+# other than zero velocity are applied.
+FAST_SCHEMES = ['rk2', 'rk4']
+FAST_VARIABLES = ['x_sea_water_velocity', 'y_sea_water_velocity', 'x_wind', 'y_wind']
+STATUS_CATEGORIES = ['active', 'stranded']
+BUFFER_CELLS = 20000000     # max trajectory x time cells per output buffer
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+FILL = np.iinfo(np.int32).max
+EXPAND_ITERATIONS = 10     # as in OpenDrift linearNDFast interpolation
+
+
+class GridField:
+    # Variables sharing one grid are stacked, so each interpolation gathers them all at once
+    def __init__(self, variables, start=None, end=None, fill='zero'):
+        da = xr.Dataset(variables).to_array('variable')
+        dims = {dim_kind(d): d for d in da.dims}
+        for d in da.dims:
+            if d != 'variable' and dim_kind(d) is None:
+                da = da.isel({d: 0})
+        if 'time' in dims and start is not None:
+            t = da[dims['time']].values
+            i0 = max(0, np.searchsorted(t, np.datetime64(start)) - 1)
+            i1 = np.searchsorted(t, np.datetime64(end), side='right') + 1
+            da = da.isel({dims['time']: slice(i0, i1)})
+        if 'time' in dims:
+            da = da.transpose(dims['time'], dims['y'], dims['x'], 'variable')
+            self.t = (da[dims['time']].values - np.datetime64('1970-01-01')) / np.timedelta64(1, 's')
+        else:
+            da = da.transpose(dims['y'], dims['x'], 'variable').expand_dims('time')
+            self.t = np.zeros(1)
+        self.names = list(da['variable'].values)
+        self.y = da[dims['y']].values.astype(float)
+        self.x = da[dims['x']].values.astype(float)
+        data = da.values.astype(np.float32)
+        if self.y[0] > self.y[-1]:
+            self.y, data = self.y[::-1], data[:, ::-1]
+        if self.x[0] > self.x[-1]:
+            self.x, data = self.x[::-1], data[:, :, ::-1]
+        # Missing values (e.g. land) give zero velocity, or are expanded from valid neighbours
+        data = expand_missing(data) if fill == 'expand' else np.nan_to_num(data)
+        self.data = np.ascontiguousarray(data).reshape(len(self.t), -1, len(self.names))
+        self.frames = {}
+
+    def frame(self, t):
+        # Field interpolated in time, cached as Runge-Kutta stages share times
+        if t not in self.frames:
+            it, wt = axis_weights(self.t, np.atleast_1d(t))
+            it, wt = it[0], wt[0]
+            frame = self.data[it] if wt == 0 else (1 - wt) * self.data[it] + wt * self.data[it + 1]
+            if len(self.frames) >= 4:
+                self.frames.pop(next(iter(self.frames)))
+            self.frames[t] = frame
+        return self.frames[t]
+
+    def __call__(self, t, lon, lat):
+        frame = self.frame(t)
+        iy, wy = axis_weights(self.y, lat)
+        ix, wx = axis_weights(self.x, lon)
+        nx = len(self.x)
+        i00 = iy * nx + ix
+        corners = ((i00, (1 - wy) * (1 - wx)), (i00 + 1, (1 - wy) * wx),
+                   (i00 + nx, wy * (1 - wx)), (i00 + nx + 1, wy * wx))
+        value = np.zeros((len(lon), len(self.names)), dtype=np.float32)
+        for index, weight in corners:
+            corner = frame.take(index, axis=0)
+            corner *= weight[:, None]
+            value += corner
+        outside = (lat < self.y[0]) | (lat > self.y[-1]) | (lon < self.x[0]) | (lon > self.x[-1])
+        value[outside] = 0
+        return dict(zip(self.names, value.T))
+
+
+def expand_missing(data, iterations=EXPAND_ITERATIONS):
+    # Missing cells take the maximum of valid neighbours, repeated as in OpenDrift's linearNDFast
+    # interpolator, data (time, y, x, variable) is expanded within each frame
+    lowest = np.finfo(data.dtype).min
+    for _ in range(iterations):
+        missing = np.isnan(data)
+        if not missing.any():
+            break
+        data[missing] = lowest
+        filled = ndimage.grey_dilation(data, size=(1, 3, 3, 1))[missing]
+        filled[filled == lowest] = np.nan
+        data[missing] = filled
+    return data
+
+
+def axis_weights(axis, values):
+    if len(axis) == 1:
+        return np.zeros(len(values), dtype=int), np.zeros(len(values), dtype=np.float32)
+    step = (axis[-1] - axis[0]) / (len(axis) - 1)
+    if np.allclose(np.diff(axis), step):  # regular grid, no search needed
+        i = np.clip(np.floor((values - axis[0]) / step).astype(int), 0, len(axis) - 2)
+    else:
+        i = np.clip(np.searchsorted(axis, values) - 1, 0, len(axis) - 2)
+    w = np.clip((values - axis[i]) / (axis[i + 1] - axis[i]), 0, 1).astype(np.float32)
+    return i, w
+
+
+def flatten(datasets):
+    if isinstance(datasets, list):
+        return [ds for d in datasets for ds in flatten(d)]
+    return [datasets] if isinstance(datasets, xr.Dataset) else []
+
+
+def forcing_fields(datasets, std_names=None, start=None, end=None):
+    std_names = std_names or {}
+    found = set()
+    fields = []
+    for ds in flatten(datasets):
+        grids = {}
+        for name, var in ds.data_vars.items():
+            standard = std_names.get(name, var.attrs.get('standard_name'))
+            if standard not in FAST_VARIABLES or standard in found:
+                continue
+            kinds = [dim_kind(d) for d in var.dims]
+            if 'x' not in kinds or 'y' not in kinds:
+                continue
+            grids.setdefault((var.dims, var.shape), {})[standard] = var.drop_attrs()
+            found.add(standard)
+        fields += [GridField(variables, start, end) for variables in grids.values()]
+    missing = [v for v in FAST_VARIABLES if v not in found]
+    if missing:
+        logging.warning(f'No forcing found for {missing}, using zero velocity.')
+    return fields
+
+
+def velocity(fields, t, lon, lat, wdf):
+    values = {}
+    for field in fields:
+        values.update(field(t, lon, lat))
+    zero = np.zeros(len(lon), dtype=np.float32)
+    u = values.get('x_sea_water_velocity', zero) + wdf * values.get('x_wind', zero)
+    v = values.get('y_sea_water_velocity', zero) + wdf * values.get('y_wind', zero)
+    return u, v
+
+
+def move(lon, lat, u, v, dt_seconds):
+    # Local WGS84 radii of curvature, accurate for displacements of one time step
+    sin2 = np.sin(np.radians(lat)) ** 2
+    meridional = WGS84_A * (1 - WGS84_E2) / (1 - WGS84_E2 * sin2) ** 1.5
+    normal = WGS84_A / np.sqrt(1 - WGS84_E2 * sin2)
+    lat_new = lat + np.degrees(v * dt_seconds / meridional)
+    lon_new = lon + np.degrees(u * dt_seconds / (normal * np.cos(np.radians(lat))))
+    return lon_new, lat_new
+
+
+def rk_step(fields, t, lon, lat, wdf, dt_seconds, scheme='rk4'):
+    u1, v1 = velocity(fields, t, lon, lat, wdf)
+    x, y = move(lon, lat, u1, v1, dt_seconds / 2)
+    u2, v2 = velocity(fields, t + dt_seconds / 2, x, y, wdf)
+    if scheme == 'rk2':
+        return move(lon, lat, u2, v2, dt_seconds)
+    x, y = move(lon, lat, u2, v2, dt_seconds / 2)
+    u3, v3 = velocity(fields, t + dt_seconds / 2, x, y, wdf)
+    x, y = move(lon, lat, u3, v3, dt_seconds)
+    u4, v4 = velocity(fields, t + dt_seconds, x, y, wdf)
+    u = (u1 + 2 * u2 + 2 * u3 + u4) / 6
+    v = (v1 + 2 * v2 + 2 * v3 + v4) / 6
+    return move(lon, lat, u, v, dt_seconds)
+
+
+def seed_positions(start_position, num=100, rad=0, seed_type='elements'):
+    # Same element layout as OpenDrift seed_elements / seed_cone
+    lat = np.atleast_1d(np.asarray(start_position[0], dtype=float))
+    lon = np.atleast_1d(np.asarray(start_position[1], dtype=float))
+    if seed_type == 'cone':
+        lat = np.linspace(lat[0], lat[-1], num)
+        lon = np.linspace(lon[0], lon[-1], num)
+        r = np.atleast_1d(rad).astype(float)
+        radius = np.linspace(r[0], r[-1], num)
+    else:
+        per_point = max(1, num // len(lat))
+        radius = np.repeat(np.broadcast_to(np.atleast_1d(rad).astype(float), lat.shape), per_point)
+        lat = np.repeat(lat, per_point)
+        lon = np.repeat(lon, per_point)
+    if radius.max() > 0:
+        x = np.random.randn(len(lat)) * radius
+        y = np.random.randn(len(lat)) * radius
+        lon, lat, _ = pyproj.Geod(ellps='WGS84').fwd(lon, lat, np.degrees(np.arctan2(x, y)), np.sqrt(x * x + y * y))
+    return np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+
+
+def output_buffer(times, lon, lat, status, wdf):
+    return xr.Dataset(
+        {'lon': (('trajectory', 'time'), lon, {'standard_name': 'longitude', 'long_name': 'longitude',
+                                               'units': 'degrees_east', 'dtype': np.float32}),
+         'lat': (('trajectory', 'time'), lat, {'standard_name': 'latitude', 'long_name': 'latitude',
+                                              'units': 'degrees_north', 'dtype': np.float32}),
+         'status': (('trajectory', 'time'), status, {'long_name': 'Status of trajectory', 'dtype': np.int32,
+                                                     'flag_values': np.arange(len(STATUS_CATEGORIES), dtype=np.int32),
+                                                     'flag_meanings': ' '.join(STATUS_CATEGORIES)}),
+         'wind_drift_factor': (('trajectory',), wdf.astype(np.float32), {'units': '1', 'dtype': np.float32})},
+        coords={'trajectory': ('trajectory', np.arange(lon.shape[0], dtype=np.int32),
+                               {'cf_role': 'trajectory_id', 'dtype': np.int32}),
+                'time': ('time', pd.to_datetime(times), {'standard_name': 'time', 'long_name': 'time',
+                                                          'dtype': np.float64})})
+
+
+def fast_simulation(start_position, start_t, end_t, datasets, std_names=None, num=100, rad=0,
+                    wdf=0.02, seed_type='elements', time_step=1800, file_name=None,
+                    scheme='rk4', diffusivity=0, landmask=True):
+    if scheme not in FAST_SCHEMES:
+        logging.error(f'Unsupported scheme {scheme}. Choose one of {FAST_SCHEMES}')
+        return
+    start_t, end_t = pd.to_datetime(start_t), pd.to_datetime(end_t)
+    dt_seconds = float(time_step)
+    steps = int(abs((end_t - start_t).total_seconds()) // abs(dt_seconds))
+    times = start_t + pd.to_timedelta(np.arange(steps + 1) * dt_seconds, unit='s')
+
+    lon, lat = seed_positions(start_position, num, rad, seed_type)
+    n = len(lon)
+    wdf = np.broadcast_to(np.asarray(wdf, dtype=np.float32), (n,)).copy()
+    t0, t1 = sorted([times[0], times[-1]])
+    fields = forcing_fields(datasets, std_names, t0, t1)
+    mask = None
+    if landmask:
+        from roaring_landmask import RoaringLandmask
+        mask = RoaringLandmask.new()
+
+    buffer_length = int(max(1, min(100, BUFFER_CELLS // max(n, 1))))
+    active = np.ones(n, dtype=bool)
+    status = np.zeros(n, dtype=np.int32)
+    epoch = (times - pd.Timestamp('1970-01-01')).total_seconds().values
+    stranded_now = np.zeros(n, dtype=bool)
+    if os.path.exists(file_name):
+        logging.warning(f'Deleting existing {file_name}')
+        os.remove(file_name)
+    encoding = None
+    start = time.perf_counter()
+    for b0 in range(0, len(times), buffer_length):
+        b1 = min(b0 + buffer_length, len(times))
+        out_lon = np.full((n, b1 - b0), np.nan, dtype=np.float32)
+        out_lat = np.full((n, b1 - b0), np.nan, dtype=np.float32)
+        out_status = np.full((n, b1 - b0), FILL, dtype=np.int32)
+        for k in range(b0, b1):
+            # Stranded elements are written once more at the time of stranding
+            record = active | stranded_now
+            out_lon[record, k - b0] = lon[record]
+            out_lat[record, k - b0] = lat[record]
+            out_status[record, k - b0] = status[record]
+            stranded_now[:] = False
+            if k == len(times) - 1 or not active.any():
+                continue
+            i = np.where(active)[0]
+            new_lon, new_lat = rk_step(fields, epoch[k], lon[i], lat[i], wdf[i], dt_seconds, scheme)
+            if diffusivity > 0:
+                sigma = np.sqrt(2 * diffusivity / abs(dt_seconds))
+                new_lon, new_lat = move(new_lon, new_lat, sigma * np.random.normal(size=len(i)),
+                                        sigma * np.random.normal(size=len(i)), abs(dt_seconds))
+            if mask is not None:
+                on_land = mask.contains_many(new_lon.astype(np.float64), new_lat.astype(np.float64))
+                stranded = i[on_land]
+                active[stranded] = False
+                status[stranded] = STATUS_CATEGORIES.index('stranded')
+                stranded_now[stranded] = True
+                new_lon, new_lat = new_lon[~on_land], new_lat[~on_land]
+                i = i[~on_land]
+            lon[i], lat[i] = new_lon, new_lat
+        buffer = output_buffer(times[b0:b1], out_lon, out_lat, out_status, wdf)
+        if encoding is None:
+            encoding = netcdf_encoding(buffer)
+            buffer.attrs = {'Conventions': 'CF-1.11', 'featureType': 'trajectory',
+                            'title': 'Fast-path surface advection (OceanDrift screening)',
+                            'model': 'OceanDrift', 'engine': f'fast-{scheme}',
+                            'time_step_calculation': str(pd.Timedelta(seconds=dt_seconds)),
+                            'time_step_output': str(pd.Timedelta(seconds=dt_seconds)),
+                            'forcing_variables': json.dumps(sorted(n for f in fields for n in f.names)),
+                            'horizontal_diffusivity': diffusivity}
+            write_netcdf_buffer(file_name, buffer, encoding)
+        else:
+            write_netcdf_buffer(file_name, buffer)
+    logging.info(f'Fast {scheme} advection of {n} elements, {steps} steps: {time.perf_counter() - start:.2f} s.')
+    return xr.open_dataset(file_name)
+
+
+# Validation harness: the same elements are advected by OpenDrift and by the
+# fast path on synthetic forcing, deviation is the distance between matching
+# trajectories at each output time.
+def synthetic_forcing(start_t, hours=48, border=[65, 68, 0, 6], resolution=0.05):
+    t = pd.date_range(pd.to_datetime(start_t), periods=hours + 1, freq='h')
+    lat = np.arange(border[0], border[1] + resolution / 2, resolution)
+    lon = np.arange(border[2], border[3] + resolution / 2, resolution)
+    T, Y, X = np.meshgrid(np.arange(len(t)) / hours, np.radians(lat), np.radians(lon), indexing='ij')
+    # Rotating eddy field drifting in time, spatially varying wind
+    uo = 0.4 * np.sin(8 * Y + 2 * T) * np.cos(6 * X)
+    vo = 0.3 * np.cos(10 * X - 2 * T) * np.sin(7 * Y)
+    u10 = 6 + 2 * np.cos(5 * Y + T)
+    v10 = 3 * np.sin(4 * X - T)
+    dims = ('time', 'latitude', 'longitude')
+    return xr.Dataset({'uo': (dims, uo.astype(np.float32)), 'vo': (dims, vo.astype(np.float32)),
+                       'u10': (dims, u10.astype(np.float32)), 'v10': (dims, v10.astype(np.float32))},
+                      coords={'time': t,
+                              'latitude': ('latitude', lat, {'standard_name': 'latitude', 'units': 'degrees_north'}),
+                              'longitude': ('longitude', lon, {'standard_name': 'longitude', 'units': 'degrees_east'})})
+
+
+def validate_fast_drift(scheme='rk4', start_t='2024-06-01 00:00:00', hours=24, time_step=900,
+                        points=10, wdf=0.03, file_prefix='validation'):
+    file_prefix = f'{file_prefix}_{scheme}'
+    from case_study_tool import simulation
+    std_names = {'uo': 'x_sea_water_velocity', 'vo': 'y_sea_water_velocity', 'u10': 'x_wind', 'v10': 'y_wind'}
+    ds = synthetic_forcing(start_t, hours=hours + 1)
+    grid = np.meshgrid(np.linspace(65.8, 67.2, points), np.linspace(1.5, 4.5, points))
+    start_position = [grid[0].ravel().tolist(), grid[1].ravel().tolist()]
+    end_t = pd.to_datetime(start_t) + pd.Timedelta(hours=hours)
+    kwargs = dict(start_position=start_position, start_t=start_t, end_t=end_t, std_names=std_names,
+                  num=points * points, rad=0, wdf=wdf, time_step=time_step)
+
+    # The reference uses the generic reader, not the memory reader built on GridField
+    timing = time.perf_counter()
+    o = simulation(model='OceanDrift', datasets=[ds], file_name=f'{file_prefix}_opendrift.nc', memory_reader=0,
+                   configurations={'drift:advection_scheme': {'rk2': 'runge-kutta', 'rk4': 'runge-kutta4'}[scheme],
+                                   'general:use_auto_landmask': False,
+                                   'environment:fallback:land_binary_mask': 0},
+                   **kwargs)
+    timing_opendrift = time.perf_counter() - timing
+    timing = time.perf_counter()
+    fast = fast_simulation(datasets=[ds], file_name=o.outfile_name.replace('_opendrift.nc', '_fast.nc'),
+                           scheme=scheme, landmask=False, **kwargs)
+    timing_fast = time.perf_counter() - timing
+
+    reference = o.result
+    _, _, distance = pyproj.Geod(ellps='WGS84').inv(reference.lon.values, reference.lat.values,
+                                                    fast.lon.values, fast.lat.values)
+    deviation = pd.DataFrame({'time': pd.to_datetime(reference.time.values),
+                              'mean_m': np.nanmean(distance, axis=0),
+                              'max_m': np.nanmax(distance, axis=0)})
+    logging.info(f'Validation {scheme}: OpenDrift {timing_opendrift:.2f} s, fast {timing_fast:.2f} s, '
+                 f'final deviation mean {deviation.mean_m.iloc[-1]:.1f} m, max {deviation.max_m.iloc[-1]:.1f} m.')
+    return deviation
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    for scheme in FAST_SCHEMES:
+        print(validate_fast_drift(scheme).iloc[::8].to_string(index=False))
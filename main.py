@@ -1,5 +1,6 @@
-from config_verification import verify_config_file
+from config_verification import verify_config_file, verify_limits
 from case_study_tool import simulation, PrepareDataSet
+from planner import plan_run
 import sys
 import json 
 import logging
@@ -20,11 +21,14 @@ def resolve_config_path(cfg: str) -> str:
     return os.path.join("INPUT", cfg)
 
 def main() -> int:
-    if len(sys.argv) < 2:
-        logging.error("Usage: python main.py <config.json>")
+    # --plan prints the cost estimate and exits, --plan=estimate.json writes it to a file
+    plan = [arg for arg in sys.argv[1:] if arg.startswith("--plan")]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--plan")]
+    if len(args) < 1:
+        logging.error("Usage: python main.py <config.json> [--plan[=estimate.json]]")
         return 1
 
-    raw_path = sys.argv[1]
+    raw_path = args[0]
     
     input_file = resolve_config_path(raw_path)
     if not os.path.exists(input_file):
@@ -38,6 +42,31 @@ def main() -> int:
         logging.error("Validation failed.")
         return 3
 
+    # Runs are planned when requested or when limits are configured
+    limits = verify_limits(input_file)
+    if plan or limits:
+        logging.info("Estimating data volume, memory and runtime...")
+        try:
+            estimate = plan_run(sim_vars, data_vars, limits)
+        except Exception as e:
+            logging.exception(f"Planning failed: {e}")
+            return 9
+        for warning in estimate["warnings"]:
+            logging.warning(warning)
+        if plan:
+            target = plan[0].partition("=")[2]
+            if target:
+                with open(target, "w") as f:
+                    json.dump(estimate, f, indent=2)
+                logging.info(f"Plan written to {target}.")
+            else:
+                print(json.dumps(estimate, indent=2))
+        if estimate["refused"]:
+            logging.error(f"Configuration refused: {estimate['refused']}")
+            return 10
+        if plan:
+            return 0
+
     vocab_path = "DATA/VariableMapping.json"
     if not os.path.exists(vocab_path):
         logging.error(f"Vocabulary file missing: {vocab_path}")
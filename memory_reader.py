@@ -0,0 +1,161 @@
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+from opendrift.readers.basereader import BaseReader, ContinuousReader
+from opendrift.readers.basereader.consts import vector_pairs_xy
+from opendrift.readers.reader_netCDF_CF_generic import Reader
+from tiled_forcing import dim_kind
+from fast_drift import GridField
+import logging
+
+# In-memory reader for small regular lat/lon forcing.
+# Variables are loaded once into contiguous float32 arrays (one stacked array
+# per grid, missing values expanded from valid neighbours) and interpolated
+# bilinearly in space and linearly in time at the element positions, without
+# xarray access or block interpolators during the run.
+# Datasets that are not on a regular lat/lon grid at a single depth use the
+# generic reader. Only variables required by the model, directly or through
+# the reader environment mappings, are loaded.
+MEMORY_READER_GB = 1.0
+VALUE_BYTES = 4
+LATLON_DIMS = {'y': ['latitude', 'lat'], 'x': ['longitude', 'lon']}
+
+
+def required_names(variables):
+    # Required variables and the reader variables they can be derived from
+    names = set(variables)
+    for xvar, eastnorth in BaseReader.xy2eastnorth_mapping.items():
+        if xvar in names:
+            names.update(eastnorth)
+    for pair in vector_pairs_xy:
+        if len(pair) >= 4 and (pair[0] in names or pair[1] in names):
+            names.update(pair[2:4])
+        if len(pair) > 2 and pair[2] in names:
+            names.update(pair[0:2])
+    if 'land_binary_mask' in names:
+        names.add('sea_floor_depth_below_sea_level')
+    return names
+
+
+def variable_mapping(ds, std_names=None, variables=None):
+    # Same selection of variables as reader_netCDF_CF_generic,
+    # limited to the required variables when given
+    std_names = std_names or {}
+    wanted = required_names(variables) if variables is not None else None
+    mapping = {}
+    for name, var in ds.data_vars.items():
+        if var.ndim < 2:
+            continue
+        if name in std_names:
+            standard = std_names[name]
+        elif 'standard_name' in var.attrs and 'hybrid' not in var.dims:
+            standard = str(var.attrs['standard_name'])
+            standard = BaseReader.variable_aliases.get(standard, standard)
+        else:
+            continue
+        if wanted is None or standard in wanted:
+            mapping[standard] = name
+    return mapping
+
+
+def grid_dims(var):
+    # Time, y and x dimension names, None if the variable is not on a lat/lon grid at a single level
+    dims = {'time': None, 'y': None, 'x': None}
+    for dim, size in var.sizes.items():
+        kind = dim_kind(dim)
+        if kind in LATLON_DIMS and dim in LATLON_DIMS[kind] or kind == 'time':
+            dims[kind] = dim
+        elif size > 1:
+            return None
+    if dims['y'] is None or dims['x'] is None:
+        return None
+    return dims
+
+
+def supported(ds, std_names=None, variables=None):
+    if not isinstance(ds, xr.Dataset):
+        return False
+    mapping = variable_mapping(ds, std_names, variables)
+    grids = [grid_dims(ds[name]) for name in mapping.values()]
+    if len(grids) == 0 or any(g is None for g in grids):
+        return False
+    # One horizontal grid per dataset, as in the generic reader
+    return len({(g['y'], g['x']) for g in grids}) == 1
+
+
+def footprint(ds, std_names=None, start=None, end=None, variables=None):
+    # Bytes of float32 forcing within the time window
+    total = 0
+    for name in variable_mapping(ds, std_names, variables).values():
+        var = ds[name]
+        dims = grid_dims(var) or {}
+        size = var.size
+        t = dims.get('time')
+        if t is not None and start is not None and var.sizes[t] > 0:
+            times = ds[t].values
+            inside = ((times >= np.datetime64(start)) & (times <= np.datetime64(end))).sum() + 2
+            size = size // var.sizes[t] * min(inside, var.sizes[t])
+        total += size * VALUE_BYTES
+    return total
+
+
+class MemoryReader(BaseReader, ContinuousReader):
+    def __init__(self, ds, standard_name_mapping={}, start=None, end=None, name=None, variables=None):
+        load = time.perf_counter()
+        mapping = variable_mapping(ds, standard_name_mapping, variables)
+        # Time dependent and static variables are stacked separately
+        groups = {}
+        for standard, var_name in mapping.items():
+            dims = grid_dims(ds[var_name])
+            groups.setdefault(dims['time'] is not None, {})[standard] = ds[var_name]
+        self.fields = [GridField(variables, start, end, fill='expand') for variables in groups.values()]
+        self.field_of = {standard: field for field in self.fields for standard in field.names}
+
+        grid = self.fields[0]
+        self.name = name or ds.attrs.get('title', 'memory_reader')
+        self.variables = list(self.field_of.keys())
+        self.proj4 = '+proj=latlong'
+        self.xmin, self.xmax = grid.x[0], grid.x[-1]
+        self.ymin, self.ymax = grid.y[0], grid.y[-1]
+        self.delta_x = (self.xmax - self.xmin) / max(len(grid.x) - 1, 1)
+        self.delta_y = (self.ymax - self.ymin) / max(len(grid.y) - 1, 1)
+        timed = [field for field in self.fields if len(field.t) > 1]
+        if timed:
+            times = pd.to_datetime(timed[0].t, unit='s')
+            self.times = [t.to_pydatetime() for t in times]
+            self.start_time, self.end_time = self.times[0], self.times[-1]
+            self.time_step = (times[1:] - times[:-1]).median().to_pytimedelta()
+        self.nbytes = sum(field.data.nbytes for field in self.fields)
+        super().__init__()
+        logging.info(f'Memory reader {self.name}: {len(self.variables)} variables, '
+                     f'{self.nbytes / 1e6:.1f} MB loaded in {time.perf_counter() - load:.1f} s.')
+
+    def get_variables(self, requested_variables, time=None, x=None, y=None, z=None):
+        t = (np.datetime64(time, 's') - np.datetime64('1970-01-01', 's')) / np.timedelta64(1, 's')
+        lon, lat = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        rotated = getattr(self, 'rotate_mapping', {})
+        names = {var: rotated.get(var, var) for var in requested_variables}
+        env = {'time': time, 'x': x, 'y': y, 'z': z}
+        values = {}
+        for field in {id(self.field_of[n]): self.field_of[n] for n in names.values()}.values():
+            values.update(field(t, lon, lat))
+        for var, source in names.items():
+            env[var] = values[source]
+        return env
+
+
+def create_readers(datasets, std_names=None, start=None, end=None, threshold=MEMORY_READER_GB, variables=None):
+    # Readers as in simulation(), required forcing under the threshold is loaded into memory
+    single = not isinstance(datasets, list)
+    datasets = [datasets] if single else datasets
+    window = sorted([pd.to_datetime(start), pd.to_datetime(end)]) if start is not None and end is not None else [None, None]
+    memory = [supported(ds, std_names, variables) for ds in datasets]
+    total = sum(footprint(ds, std_names, *window, variables) for ds, m in zip(datasets, memory) if m)
+    if threshold is None or total > threshold * 1e9:
+        memory = [False] * len(datasets)
+        if threshold is not None:
+            logging.info(f'Forcing footprint {total / 1e9:.2f} GB exceeds {threshold} GB, using generic readers.')
+    readers = [MemoryReader(ds, std_names or {}, *window, variables=variables) if m else Reader(ds, standard_name_mapping=std_names)
+               for ds, m in zip(datasets, memory)]
+    return readers[0] if single else readers
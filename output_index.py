@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+import logging
+
+# Spatio-temporal index over simulation outputs.
+# For every output file the index stores per time bucket the bounding box and
+# number of elements, and the number of elements per coarse lat/lon cell.
+# Files are indexed incrementally: unchanged files (same size and modification
+# time) are skipped, changed files are re-indexed, deleted files are removed.
+BUCKET_SECONDS = 3600
+CELL_DEGREES = 0.1
+INDEX_NAME = 'output_index.sqlite'
+READ_ELEMENTS = 100000      # trajectories read from file at once
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER,
+    model TEXT, start_time INTEGER, end_time INTEGER, elements INTEGER);
+CREATE TABLE IF NOT EXISTS buckets (
+    run_id INTEGER, bucket INTEGER, min_lat REAL, max_lat REAL,
+    min_lon REAL, max_lon REAL, elements INTEGER);
+CREATE TABLE IF NOT EXISTS cells (
+    run_id INTEGER, bucket INTEGER, cell_lat INTEGER, cell_lon INTEGER, elements INTEGER);
+CREATE INDEX IF NOT EXISTS buckets_time ON buckets (bucket, min_lat, max_lat, min_lon, max_lon);
+CREATE INDEX IF NOT EXISTS cells_space ON cells (cell_lat, cell_lon, bucket);
+"""
+
+
+def default_output_dir():
+    output_dir = os.getenv("OUTPUT")
+    if output_dir is None:
+        output_dir = "/OUTPUT" if os.path.exists("/OUTPUT") and not os.getenv("CI") else "OUTPUT"
+    return output_dir
+
+
+def connect(db_path, bucket_seconds=BUCKET_SECONDS, cell_degrees=CELL_DEGREES):
+    con = sqlite3.connect(db_path)
+    con.executescript(SCHEMA)
+    settings = {'bucket_seconds': str(bucket_seconds), 'cell_degrees': str(cell_degrees)}
+    stored = dict(con.execute('SELECT key, value FROM meta').fetchall())
+    if stored and stored != settings:
+        raise ValueError(f'Index {db_path} was built with {stored}, requested {settings}. '
+                         f'Use a new index file.')
+    con.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', settings.items())
+    return con
+
+
+def scan_output(path, bucket_seconds=BUCKET_SECONDS, cell_degrees=CELL_DEGREES):
+    with xr.open_dataset(path) as ds:
+        times = (ds.time.values - np.datetime64('1970-01-01')) / np.timedelta64(1, 's')
+        buckets = (times // bucket_seconds).astype(np.int64)
+        ntraj = ds.sizes['trajectory']
+        model = ds.attrs.get('opendrift_class', ds.attrs.get('model', os.path.basename(path).split('_')[0]))
+        boxes, cells = {}, []
+        seen = np.zeros(ntraj, dtype=bool)
+        for bucket in np.unique(buckets):
+            t = np.where(buckets == bucket)[0]
+            box = [np.inf, -np.inf, np.inf, -np.inf]
+            count = 0
+            for i0 in range(0, ntraj, READ_ELEMENTS):
+                part = {'trajectory': slice(i0, i0 + READ_ELEMENTS), 'time': slice(t[0], t[-1] + 1)}
+                lat = ds.lat[part].values
+                lon = ds.lon[part].values
+                valid = np.isfinite(lat) & np.isfinite(lon)
+                if not valid.any():
+                    continue
+                count += int(valid.any(axis=1).sum())
+                seen[i0:i0 + lat.shape[0]] |= valid.any(axis=1)
+                box = [min(box[0], lat[valid].min()), max(box[1], lat[valid].max()),
+                       min(box[2], lon[valid].min()), max(box[3], lon[valid].max())]
+                # Distinct elements per cell within the bucket
+                traj = np.broadcast_to(np.arange(i0, i0 + lat.shape[0])[:, None], lat.shape)[valid]
+                cell_lat = np.floor(lat[valid] / cell_degrees).astype(np.int64)
+                cell_lon = np.floor(lon[valid] / cell_degrees).astype(np.int64)
+                visits = np.unique(np.stack([cell_lat, cell_lon, traj]), axis=1)
+                occupied, counts = np.unique(visits[:2], axis=1, return_counts=True)
+                cells.append(pd.DataFrame({'bucket': int(bucket), 'cell_lat': occupied[0],
+                                           'cell_lon': occupied[1], 'elements': counts}))
+            if count > 0:
+                boxes[int(bucket)] = (*map(float, box), count)
+        run = {'model': model, 'start_time': int(times.min()), 'end_time': int(times.max()),
+               'elements': int(seen.sum())}
+    cells = pd.concat(cells) if cells else pd.DataFrame(columns=['bucket', 'cell_lat', 'cell_lon', 'elements'])
+    cells = cells.groupby(['bucket', 'cell_lat', 'cell_lon'], as_index=False)['elements'].sum()
+    return run, boxes, cells
+
+
+def update_index(output_dir=None, db_path=None, bucket_seconds=BUCKET_SECONDS, cell_degrees=CELL_DEGREES):
+    output_dir = output_dir or default_output_dir()
+    db_path = db_path or os.path.join(output_dir, INDEX_NAME)
+    con = connect(db_path, bucket_seconds, cell_degrees)
+    indexed = {path: (run_id, mtime, size) for run_id, path, mtime, size
+               in con.execute('SELECT id, path, mtime, size FROM runs')}
+    files = sorted(os.path.abspath(os.path.join(output_dir, f)) for f in os.listdir(output_dir) if f.endswith('.nc'))
+    stats = {'indexed': 0, 'skipped': 0, 'removed': 0, 'failed': 0}
+
+    for path in set(indexed) - set(files):
+        delete_run(con, indexed[path][0])
+        stats['removed'] += 1
+
+    for path in files:
+        st = os.stat(path)
+        if path in indexed and indexed[path][1:] == (st.st_mtime, st.st_size):
+            stats['skipped'] += 1
+            continue
+        try:
+            run, boxes, cells = scan_output(path, bucket_seconds, cell_degrees)
+        except Exception as e:
+            logging.warning(f'Unable to index {path}: {e}')
+            stats['failed'] += 1
+            continue
+        with con:
+            if path in indexed:
+                delete_run(con, indexed[path][0])
+            cur = con.execute('INSERT INTO runs (path, mtime, size, model, start_time, end_time, elements) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (path, st.st_mtime, st.st_size, run['model'], run['start_time'],
+                               run['end_time'], run['elements']))
+            run_id = cur.lastrowid
+            con.executemany('INSERT INTO buckets VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [(run_id, bucket, *box) for bucket, box in boxes.items()])
+            con.executemany('INSERT INTO cells VALUES (?, ?, ?, ?, ?)',
+                            [(run_id, *row) for row in cells.itertuples(index=False, name=None)])
+        stats['indexed'] += 1
+    con.commit()
+    con.close()
+    logging.info(f'Index {db_path}: {stats}')
+    return stats
+
+
+def delete_run(con, run_id):
+    for table, key in [('cells', 'run_id'), ('buckets', 'run_id'), ('runs', 'id')]:
+        con.execute(f'DELETE FROM {table} WHERE {key} = ?', (run_id,))
+
+
+def query_index(db_path, box, start=None, end=None):
+    # box = [min_lat, max_lat, min_lon, max_lon], same order as border.
+    # elements: per run the maximum over time buckets of elements in cells touching the box
+    # (upper bound, an element visiting two cells within one bucket is counted twice,
+    # capped at the number of elements present in the bucket).
+    con = sqlite3.connect(db_path)
+    meta = dict(con.execute('SELECT key, value FROM meta').fetchall())
+    bucket_seconds, cell_degrees = int(meta['bucket_seconds']), float(meta['cell_degrees'])
+    b0 = int(pd.to_datetime(start).timestamp()) // bucket_seconds if start is not None else -2**62
+    b1 = int(pd.to_datetime(end).timestamp()) // bucket_seconds if end is not None else 2**62
+    c = [int(np.floor(v / cell_degrees)) for v in box]
+    rows = con.execute(
+        """SELECT r.path, r.model, r.start_time, r.end_time, MAX(s.elements), COUNT(s.bucket)
+           FROM runs r JOIN (
+               SELECT c.run_id, c.bucket, MIN(SUM(c.elements), b.elements) AS elements
+               FROM buckets b JOIN cells c ON c.run_id = b.run_id AND c.bucket = b.bucket
+               WHERE b.bucket BETWEEN ? AND ?
+                 AND b.max_lat >= ? AND b.min_lat <= ? AND b.max_lon >= ? AND b.min_lon <= ?
+                 AND c.cell_lat BETWEEN ? AND ? AND c.cell_lon BETWEEN ? AND ?
+               GROUP BY c.run_id, c.bucket) s ON s.run_id = r.id
+           GROUP BY r.id ORDER BY r.start_time""",
+        (b0, b1, box[0], box[1], box[2], box[3], c[0], c[1], c[2], c[3])).fetchall()
+    con.close()
+    return [{'path': path, 'model': model,
+             'start_time': str(pd.to_datetime(t0, unit='s')), 'end_time': str(pd.to_datetime(t1, unit='s')),
+             'elements': elements, 'buckets': buckets}
+            for path, model, t0, t1, elements, buckets in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spatio-temporal index over simulation outputs.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    idx = sub.add_parser('index', help='scan output folder and update the index')
+    idx.add_argument('folder', nargs='?', default=None)
+    idx.add_argument('--db', default=None)
+    idx.add_argument('--bucket', type=int, default=BUCKET_SECONDS, help='time bucket in seconds')
+    idx.add_argument('--cell', type=float, default=CELL_DEGREES, help='cell size in degrees')
+    qry = sub.add_parser('query', help='find runs with elements in a box and time range')
+    qry.add_argument('box', nargs=4, type=float, metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON'))
+    qry.add_argument('--start', default=None)
+    qry.add_argument('--end', default=None)
+    qry.add_argument('--db', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        update_index(args.folder, args.db, args.bucket, args.cell)
+        return 0
+    db_path = args.db or os.path.join(default_output_dir(), INDEX_NAME)
+    if not os.path.exists(db_path):
+        logging.error(f'Index {db_path} does not exist. Run "python output_index.py index" first.')
+        return 1
+    t = time.perf_counter()
+    result = query_index(db_path, args.box, args.start, args.end)
+    print(json.dumps(result, indent=2))
+    logging.info(f'{len(result)} runs found in {1000 * (time.perf_counter() - t):.1f} ms.')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import psutil
+from case_study_tool import model_dict, load_seed_file
+from memory_reader import MEMORY_READER_GB
+
+# Dry-run planning. Estimates forcing volume, memory, output size and runtime of
+# a verified configuration without downloading or simulating anything, and
+# refuses configurations that exceed the limits.
+# Forcing volume is computed from border, time window and product resolution
+# for Copernicus, and from file metadata (coordinates and shapes) for folder data.
+# Runtime constants are rough, measured on a single core with synthetic forcing.
+GB = 1e9
+VALUE_BYTES = 4                     # forcing is read as float32
+EXPORT_BUFFER = 100                 # OpenDrift export_buffer_length
+STATE_OVERHEAD = 3                  # temporary arrays during interpolation and advection
+DOWNLOAD_RATE = 20e6                # bytes/s from Copernicus Marine
+SECONDS_PER_STEP = {'opendrift': 0.05, 'fast': 0.01}
+SECONDS_PER_ELEMENT_STEP = {'opendrift': 6e-6, 'fast': 6e-7}
+FAST_OUTPUT_BYTES = 12              # lon, lat, status per element and output step
+PLAN_LIMITS = {'download_gb': 20, 'memory_gb': None, 'output_gb': 50, 'runtime_h': 24}
+MEMORY_FRACTION = 0.8               # default memory limit as fraction of total RAM
+
+# Products opened by PrepareDataSet: grid step in degrees, time step in seconds
+# (None for static fields) and number of variables in the subset.
+COPERNICUS_PRODUCTS = {
+    'cmems_mod_bal_phy_anfc_PT1H-i': {'dlat': 1 / 60, 'dlon': 1 / 36, 'dt': 3600, 'variables': 10},
+    'cmems_mod_bal_wav_anfc_PT1H-i': {'dlat': 1 / 60, 'dlon': 1 / 36, 'dt': 3600, 'variables': 16},
+    'cmems_mod_glo_phy_anfc_0.083deg_PT1H-m': {'dlat': 1 / 12, 'dlon': 1 / 12, 'dt': 3600, 'variables': 5},
+    'cmems_mod_glo_wav_anfc_0.083deg_PT3H-i': {'dlat': 1 / 12, 'dlon': 1 / 12, 'dt': 10800, 'variables': 17},
+    'cmems_mod_bal_wav_anfc_static': {'dlat': 1 / 60, 'dlon': 1 / 36, 'dt': None, 'variables': 3},
+}
+COPERNICUS_BALTIC = ['cmems_mod_bal_phy_anfc_PT1H-i', 'cmems_mod_bal_wav_anfc_PT1H-i']
+COPERNICUS_GLOBAL = ['cmems_mod_glo_phy_anfc_0.083deg_PT1H-m', 'cmems_mod_glo_wav_anfc_0.083deg_PT3H-i']
+COPERNICUS_STATIC = ['cmems_mod_bal_wav_anfc_static']
+BALTIC_DOMAIN = [53.0, 66.0, 9.0, 30.5]
+DEFAULT_BORDER = [54, 62, 13, 30]
+
+
+def copernicus_volume(border, start_t, end_t):
+    # Baltic products are tried first, global products are used outside the Baltic domain
+    inside = (border[0] >= BALTIC_DOMAIN[0] and border[1] <= BALTIC_DOMAIN[1] and
+              border[2] >= BALTIC_DOMAIN[2] and border[3] <= BALTIC_DOMAIN[3])
+    products = (COPERNICUS_BALTIC if inside else COPERNICUS_GLOBAL) + COPERNICUS_STATIC
+    seconds = abs((end_t - start_t).total_seconds())
+    volume = []
+    for dataset_id in products:
+        p = COPERNICUS_PRODUCTS[dataset_id]
+        ny = int(np.floor((border[1] - border[0]) / p['dlat'])) + 1
+        nx = int(np.floor((border[3] - border[2]) / p['dlon'])) + 1
+        nt = int(seconds // p['dt']) + 1 if p['dt'] else 1
+        volume.append({'dataset_id': dataset_id, 'shape': [nt, ny, nx], 'variables': p['variables'],
+                       'bytes': nt * ny * nx * p['variables'] * VALUE_BYTES})
+    return volume
+
+
+def open_forcing_file(path):
+    # Only coordinates and shapes are used, data variables are not loaded
+    if path.endswith('.grib'):
+        ds = xr.open_dataset(path, engine='cfgrib')
+        ds = ds.assign_coords(time=ds['time'] + ds['step'])
+        return ds.swap_dims({'step': 'time'})
+    return xr.open_dataset(path, engine='netcdf4')
+
+
+def forcing_files(folder, concatenation=False):
+    # Groups of files that are combined into one dataset by PrepareDataSet
+    folders = [folder]
+    if concatenation:
+        folders = [os.path.join(folder, d) for d in sorted(os.listdir(folder))
+                   if os.path.isdir(os.path.join(folder, d))]
+    groups = {}
+    for path in folders:
+        for file in sorted(os.listdir(path)):
+            ext = os.path.splitext(file)[1]
+            if ext in ['.grib', '.nc']:
+                groups.setdefault((path, ext), []).append(os.path.join(path, file))
+    return groups
+
+
+def time_coverage(times, start_t, end_t):
+    times = np.unique(times)
+    first, last = pd.to_datetime(times[0]), pd.to_datetime(times[-1])
+    gaps = []
+    if len(times) > 2:
+        steps = np.diff(times)
+        window = (times[1:] > np.datetime64(start_t)) & (times[:-1] < np.datetime64(end_t))
+        large = window & (steps > 1.5 * np.median(steps))
+        gaps = [[str(pd.to_datetime(a)), str(pd.to_datetime(b))]
+                for a, b in zip(times[:-1][large], times[1:][large])]
+    return {'first': str(first), 'last': str(last),
+            'covered': bool(first <= start_t and last >= end_t and not gaps), 'gaps': gaps}
+
+
+def folder_volume(folder, start_t, end_t, concatenation=False):
+    volume, warnings = [], []
+    for (path, ext), files in forcing_files(folder, concatenation).items():
+        times, nbytes = [], 0
+        for file in files:
+            try:
+                with open_forcing_file(file) as ds:
+                    t = ds['time'].values if 'time' in ds.dims else np.array([], dtype='datetime64[ns]')
+                    inside = int(((t >= np.datetime64(start_t)) & (t <= np.datetime64(end_t))).sum())
+                    for var in ds.data_vars.values():
+                        values = var.size // ds.sizes['time'] * inside if 'time' in var.dims else var.size
+                        nbytes += values * VALUE_BYTES
+                    times.append(t)
+            except Exception as e:
+                warnings.append(f'Unable to read metadata of {file}: {e}')
+        times = np.concatenate(times) if times else np.array([], dtype='datetime64[ns]')
+        entry = {'source': os.path.join(path, '*' + ext), 'files': len(files), 'bytes': nbytes}
+        if len(times) > 0:
+            entry.update(time_coverage(times, start_t, end_t))
+            if not entry['covered']:
+                warnings.append(f"{entry['source']} does not cover {start_t} - {end_t} "
+                                f"(data {entry['first']} - {entry['last']}, {len(entry['gaps'])} gaps).")
+        volume.append(entry)
+    return volume, warnings
+
+
+def element_count(sim_vars):
+    members = sim_vars.get('ensemble', {}).get('members', 1) if sim_vars.get('ensemble') else 1
+    if sim_vars.get('seed_file') is not None:
+        df = load_seed_file(sim_vars['seed_file'], sim_vars.get('model', 'OceanDrift'), sim_vars['start_t'],
+                            rad=sim_vars.get('rad', 0), ship=sim_vars.get('ship', [62, 8, 10, 5]),
+                            wdf=sim_vars.get('wdf', 0.02), lw_obj=sim_vars.get('lw_obj', 1), copies=members,
+                            end_t=sim_vars['end_t'])
+        return len(df)
+    return sim_vars.get('num', 100) * members
+
+
+def element_bytes(model):
+    # Element properties with their dtypes, environment variables stored as float32
+    element = sum(np.dtype(v.get('dtype', np.float32)).itemsize for v in model.ElementType.variables.values())
+    return element + len(model.required_variables) * VALUE_BYTES
+
+
+def default_limits():
+    limits = dict(PLAN_LIMITS)
+    limits['memory_gb'] = round(MEMORY_FRACTION * psutil.virtual_memory().total / GB, 1)
+    return limits
+
+
+def plan_run(sim_vars, data_vars, limits=None):
+    start_t = pd.to_datetime(sim_vars['start_t'])
+    end_t = pd.to_datetime(sim_vars['end_t'])
+    window = (min(start_t, end_t), max(start_t, end_t))
+    engine = 'fast' if str(sim_vars.get('engine', 'opendrift')).startswith('fast') else 'opendrift'
+    model = model_dict[sim_vars.get('model', 'OceanDrift')]
+    time_step = abs(sim_vars.get('time_step') or 3600)
+    warnings = []
+
+    # Forcing
+    forcing = []
+    if data_vars.get('folder') is not None:
+        forcing, warnings = folder_volume(data_vars['folder'], *window, data_vars.get('concatenation', False))
+    download = []
+    if data_vars.get('copernicus'):
+        download = copernicus_volume(data_vars.get('border') or DEFAULT_BORDER, *window)
+    forcing_bytes = sum(f['bytes'] for f in forcing + download)
+    download_bytes = sum(f['bytes'] for f in download)
+
+    # Elements and output
+    elements = element_count(sim_vars)
+    steps = int((window[1] - window[0]).total_seconds() // time_step)
+    outputs = steps + 1
+    per_element = FAST_OUTPUT_BYTES if engine == 'fast' else element_bytes(model)
+    state_bytes = elements * per_element * STATE_OVERHEAD
+    buffers = 1 + sim_vars.get('async_writer', {}).get('queue', 2) if sim_vars.get('async_writer') else 1
+    buffer_bytes = elements * min(EXPORT_BUFFER, outputs) * per_element * buffers
+    output_bytes = elements * outputs * per_element
+    memory_bytes = state_bytes + buffer_bytes + forcing_bytes
+
+    runtime = (steps * (SECONDS_PER_STEP[engine] + elements * SECONDS_PER_ELEMENT_STEP[engine])
+               + download_bytes / DOWNLOAD_RATE)
+
+    estimate = {'download_gb': download_bytes / GB, 'memory_gb': memory_bytes / GB,
+                'output_gb': output_bytes / GB, 'runtime_h': runtime / 3600}
+    limits = {**default_limits(), **(limits or {})}
+    refused = [f'{key} {estimate[key]:.3g} exceeds limit {limits[key]}'
+               for key in estimate if limits.get(key) is not None and estimate[key] > limits[key]]
+
+    return {'engine': engine, 'model': model.__name__,
+            'start_t': str(start_t), 'end_t': str(end_t),
+            'elements': elements, 'time_step': time_step, 'steps': steps, 'outputs': outputs,
+            'forcing': {'folder': forcing, 'copernicus': download, 'bytes': forcing_bytes,
+                        'memory_reader': engine == 'opendrift' and not sim_vars.get('adaptive_forcing')
+                        and 0 < forcing_bytes <= sim_vars.get('memory_reader', MEMORY_READER_GB) * GB},
+            'memory': {'state_bytes': state_bytes, 'export_buffer_bytes': buffer_bytes,
+                       'forcing_bytes': forcing_bytes, 'total_bytes': memory_bytes},
+            'output_bytes': output_bytes, 'runtime_s': runtime,
+            'estimate': {key: round(value, 4) for key, value in estimate.items()},
+            'limits': limits, 'warnings': warnings, 'refused': refused}
@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import numpy as np
+import pandas as pd
+import logging
+
+# Live streaming of particle snapshots while a simulation is running.
+# Snapshots are put into a bounded queue and written by a background thread,
+# when the queue is full the oldest snapshot is dropped, so a slow consumer
+# never stalls the model.
+# Targets:
+#   path/to/file.jsonl      - JSON lines file
+#   fifo:/path/to/pipe      - named pipe (created if missing)
+#   unix:/path/to/socket    - local unix socket (consumer listens)
+#   tcp://host:port         - TCP socket (consumer listens)
+STREAM_BUFFER = 100
+STREAM_PRECISION = 5
+
+
+class AbortSimulation(Exception):
+    pass
+
+
+def open_stream_target(target):
+    if target.startswith('fifo:'):
+        path = target[len('fifo:'):]
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        return open(path, 'w')  # blocks until a reader opens the pipe
+    if target.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target[len('unix:'):])
+        return sock.makefile('w')
+    if target.startswith('tcp://'):
+        host, port = target[len('tcp://'):].rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+        return sock.makefile('w')
+    return open(target, 'a')
+
+
+class SnapshotStreamer:
+    def __init__(self, target, buffer=STREAM_BUFFER, abort_file=None):
+        self.target = target
+        self.abort_file = abort_file
+        self.queue = queue.Queue(maxsize=buffer)
+        self.steps = 0
+        self.dropped = 0
+        self.failed = False
+        self.started = None
+        self.thread = threading.Thread(target=self._write, daemon=True)
+
+    def start(self, **info):
+        self.started = time.time()
+        if self.abort_file is not None and os.path.exists(self.abort_file):
+            logging.warning(f'Abort file {self.abort_file} is older than this run and is ignored.')
+        self.thread.start()
+        self.put({'event': 'start', **info})
+        return self
+
+    def put(self, record):
+        if self.failed:
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def aborted(self):
+        # Only abort files created after the run started count, an honoured file is removed
+        if self.abort_file is None:
+            return False
+        try:
+            if os.path.getmtime(self.abort_file) < self.started:
+                return False
+            os.remove(self.abort_file)
+        except OSError:
+            return False
+        return True
+
+    def close(self, timeout=10):
+        self.put({'event': 'end', 'dropped': self.dropped})
+        self.put(None)
+        self.thread.join(timeout)
+        if self.dropped > 0:
+            logging.warning(f'Stream {self.target}: {self.dropped} snapshots dropped by slow consumer.')
+
+    def _write(self):
+        try:
+            stream = open_stream_target(self.target)
+        except OSError as e:
+            logging.error(f'Unable to open stream target {self.target}: {e}. Streaming disabled.')
+            self.failed = True
+            return
+        with stream:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                try:
+                    stream.write(json.dumps(record) + '\n')
+                    stream.flush()
+                except OSError as e:
+                    logging.error(f'Stream {self.target} closed by consumer: {e}. Streaming disabled.')
+                    self.failed = True
+                    break
+
+
+def snapshot(o, step):
+    e = o.elements
+    record = {'event': 'step', 'step': step, 'time': pd.to_datetime(o.time).isoformat(),
+              'id': e.ID.tolist(), 'status': e.status.tolist(),
+              'lon': np.round(e.lon.astype(float), STREAM_PRECISION).tolist(),
+              'lat': np.round(e.lat.astype(float), STREAM_PRECISION).tolist()}
+    return record
+
+
+class StreamMixin:
+    streamer = None
+
+    def state_to_buffer(self, final=False):
+        output_step = pd.to_datetime(self.time) in self.result.time
+        super().state_to_buffer(final=final)
+        if not output_step or self.streamer is None:
+            return
+        self.streamer.put(snapshot(self, self.streamer.steps))
+        self.streamer.steps += 1
+        # OpenDrift treats a stop within the first steps as failure, abort after that
+        if not final and self.steps_calculation > 1 and self.streamer.aborted():
+            raise AbortSimulation(f'Abort file {self.streamer.abort_file} found, stopping simulation.')
@@ -1,5 +1,20 @@
 from config_verification import verify_config_file
-from case_study_tool import PrepareDataSet, simulation
+from case_study_tool import PrepareDataSet, simulation, load_seed_file, ensemble_perturbations, ensemble_statistics
+from stream_tool import SnapshotStreamer
+from tiled_forcing import tile_datasets
+from fast_drift import validate_fast_drift
+from output_index import update_index, query_index
+from planner import plan_run
+from memory_reader import MemoryReader, create_readers
+from opendrift.readers.reader_netCDF_CF_generic import Reader
+from opendrift.models.leeway import Leeway
+import opendrift
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
 
 
 def test_config_verification():
@@ -36,3 +51,185 @@ def test_simulation():
     }
     o = simulation(datasets=[], **sim_vars)    
     assert o is not None
+
+def test_seed_file(tmp_path):
+    seed_file = tmp_path / "seed.csv"
+    seed_file.write_text(
+        "lat,lon,release_time,radius,wdf,number\n"
+        "57.5,23.7,2024-06-01 00:00,100,0.03,2\n"
+        "57.6,23.8,2024-06-01 00:10,0,,1\n"
+        "95.0,23.8,2024-06-01 00:10,0,0.02,1\n"
+        "57.6,23.8,2024-06-05 00:00,0,0.02,1\n"
+        "57.7,23.9,,0,0.01,1\n"
+        "57.7,23.9,not a date,0,0.01,1\n"
+    )
+    df = load_seed_file(str(seed_file), "OceanDrift", "2024-06-01 00:00:00", wdf=0.02, end_t="2024-06-03 00:00:00")
+    assert len(df) == 4
+    assert list(df["wdf"]) == [0.03, 0.03, 0.02, 0.01]
+    assert df["time"].iloc[-1] == pd.Timestamp("2024-06-01 00:00:00")
+    assert list(load_seed_file(str(seed_file), "OceanDrift", "2024-06-01 00:00:00", wdf=0)["wdf"]) == [0.03, 0.03, 0, 0.02, 0.01]
+    assert len(load_seed_file(str(seed_file), "OceanDrift", "2024-06-01 00:00:00", wdf=[0.01, 0.02, 0.03])) == 5
+
+def test_seed_file_config(tmp_path, caplog):
+    seed_file = tmp_path / "seed.csv"
+    seed_file.write_text("lat,lon\n57.5,23.7\n")
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"model": "OceanDrift", "seed_file": str(seed_file),
+                                  "start_t": "2024-06-01 00:00:00", "end_t": "2024-06-01 06:00:00",
+                                  "ensemble": {"members": 2}}))
+    valid, sim_vars, _ = verify_config_file(str(config))
+    assert valid is True and "num" not in sim_vars
+    assert not [r for r in caplog.records if r.levelname == "ERROR"]
+
+def test_ensemble_perturbations():
+    p = ensemble_perturbations(members=5, current={"scale": 0.1, "rotation": 10, "offset": 0.05}, seed=0)
+    assert len(p["current"]["scale"]) == 5
+    assert p["current"]["scale"][0] == 1 and p["current"]["rotation"][0] == 0
+    assert all(p["wind"]["scale"] == 1)
+
+def test_ensemble_simulation(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT", str(tmp_path))
+    for scheme in ["euler", "runge-kutta4"]:
+        o = simulation(datasets=[], model="OceanDrift", start_position=[57.5, 23.7],
+                       start_t="2024-06-01 00:00:00", end_t="2024-06-01 12:00:00", num=1, wdf=0.0,
+                       time_step=1800, file_name=f"ensemble_{scheme}.nc",
+                       ensemble={"members": 2, "current": {"offset": 0.5}, "seed": 1},
+                       configurations={"drift:advection_scheme": scheme})
+        p = o.ensemble["current"]
+        stats = ensemble_statistics(xr.open_dataset(o.outfile_name))
+        assert list(stats.ensemble_member.values) == [0, 1]
+        moved = stats.isel(time=-1) - stats.isel(time=0)
+        expected_lat = p["y_offset"][1] * 12 * 3600 / 111320
+        assert abs(moved.lat.sel(ensemble_member=0)) < 1e-6
+        assert np.isclose(moved.lat.sel(ensemble_member=1), expected_lat, rtol=0.02)
+
+def test_stream_buffer():
+    streamer = SnapshotStreamer("unused.jsonl", buffer=2)
+    for step in range(5):
+        streamer.put({"step": step})
+    assert streamer.dropped == 3
+    assert streamer.queue.get_nowait() == {"step": 3}
+
+def test_stream_simulation(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT", str(tmp_path))
+    target, abort_file = tmp_path / "stream.jsonl", tmp_path / "abort"
+    abort_file.write_text("")  # left over from an earlier run, must not stop this one
+    simulation(datasets=[], model="OceanDrift", start_position=[57.5, 23.7], start_t="2024-06-01 00:00:00",
+               end_t="2024-06-01 06:00:00", num=5, time_step=1800, file_name="stream.nc",
+               stream={"target": str(target), "abort_file": str(abort_file)})
+    records = [json.loads(line) for line in target.read_text().splitlines()]
+    steps = [r for r in records if r["event"] == "step"]
+    assert records[0]["event"] == "start" and records[-1]["event"] == "end"
+    assert len(steps) == 13 and len(steps[-1]["lon"]) == 5
+
+    streamer = SnapshotStreamer(str(target), abort_file=str(abort_file)).start()
+    assert not streamer.aborted()
+    os.utime(abort_file, (streamer.started + 1, streamer.started + 1))
+    assert streamer.aborted() and not abort_file.exists()
+    streamer.close()
+
+def test_tiled_forcing():
+    lat = np.linspace(56, 59, 100)
+    lon = np.linspace(21, 25, 120)
+    ds = xr.Dataset({"uo": (("time", "latitude", "longitude"), np.random.rand(10, 100, 120).astype("float32"))},
+                    coords={"time": pd.date_range("2024-06-01", periods=10, freq="h"),
+                            "latitude": lat, "longitude": lon})
+    [tiled], cache = tile_datasets([ds], lookahead=3600, tile_size=16)
+    subset = {"time": 2, "latitude": slice(40, 60), "longitude": np.arange(50, 75)}
+    assert np.array_equal(tiled.uo.isel(subset).values, ds.uo.isel(subset).values)
+    assert 0 < cache.loaded_bytes < ds.uo.nbytes
+
+def test_async_writer(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT", str(tmp_path))
+    sim_vars = {
+        "model": "OceanDrift",
+        "start_position": [57.5, 23.7],
+        "start_t": "2024-06-01 00:00:00",
+        "end_t": "2024-06-03 00:00:00",
+        "num": 10,
+        "time_step": 600,
+        "file_name": "test_async_output.nc",
+        "async_writer": {"queue": 1},
+    }
+    o = simulation(datasets=[], **sim_vars)
+    assert o.writer.statistics()["buffers"] == 3
+    assert o.result.sizes["time"] == 289
+
+def test_mixin_output_class(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT", str(tmp_path))
+    o = simulation(datasets=[], model="Leeway", start_position=[57.5, 23.7], start_t="2024-06-01 00:00:00",
+                   end_t="2024-06-01 03:00:00", num=5, time_step=1800, file_name="mixin.nc",
+                   configurations={f"environment:fallback:{v}": 0 for v in
+                                   ["x_wind", "y_wind", "x_sea_water_velocity", "y_sea_water_velocity"]},
+                   async_writer={"queue": 2})
+    reopened = opendrift.open(o.outfile_name)
+    assert type(reopened) is Leeway
+
+def test_fast_drift_validation(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT", str(tmp_path))
+    deviation = validate_fast_drift("rk4", hours=6, points=3, file_prefix="test_validation")
+    assert deviation.max_m.max() < 100
+
+def test_output_index(tmp_path):
+    time = pd.date_range("2024-06-01", periods=5, freq="h")
+    lat = np.array([[57.0, 57.1, 57.2, 57.3, np.nan], [58.0, 58.0, 58.0, 58.0, 58.0]])
+    lon = np.array([[21.0, 21.1, 21.2, 21.3, np.nan], [24.0, 24.0, 24.0, 24.0, 24.0]])
+    xr.Dataset({"lat": (("trajectory", "time"), lat), "lon": (("trajectory", "time"), lon)},
+               coords={"trajectory": [0, 1], "time": time}).to_netcdf(tmp_path / "OceanDrift_test.nc")
+    db = str(tmp_path / "index.sqlite")
+    assert update_index(str(tmp_path), db)["indexed"] == 1
+    assert update_index(str(tmp_path), db)["skipped"] == 1
+    runs = query_index(db, [56.9, 57.15, 20.9, 21.15], "2024-06-01 00:00", "2024-06-01 01:00")
+    assert len(runs) == 1 and runs[0]["elements"] == 1
+    assert query_index(db, [56.9, 57.15, 20.9, 21.15], "2024-06-01 03:00", "2024-06-01 04:00") == []
+    # One element crossing a cell edge within a bucket is counted once
+    xr.Dataset({"lat": (("trajectory", "time"), [[60.05, 60.15]]), "lon": (("trajectory", "time"), [[20.05, 20.05]])},
+               coords={"trajectory": [0], "time": pd.date_range("2024-06-01", periods=2, freq="30min")}
+               ).to_netcdf(tmp_path / "Leeway_test.nc")
+    update_index(str(tmp_path), db)
+    assert query_index(db, [60.0, 60.2, 20.0, 20.1])[0]["elements"] == 1
+
+def test_plan(tmp_path):
+    for day in ["2024-06-01", "2024-06-03"]:
+        xr.Dataset({"uo": (("time", "latitude", "longitude"), np.zeros((24, 10, 20), dtype="float32"))},
+                   coords={"time": pd.date_range(day, periods=24, freq="h"),
+                           "latitude": np.linspace(56, 59, 10), "longitude": np.linspace(21, 25, 20)}
+                   ).to_netcdf(tmp_path / f"forcing_{day}.nc")
+    sim_vars = {"model": "OceanDrift", "start_t": "2024-06-01 00:00:00", "end_t": "2024-06-01 12:00:00",
+                "num": 1000, "time_step": 1800}
+    estimate = plan_run(sim_vars, {"folder": str(tmp_path)})
+    assert estimate["steps"] == 24 and estimate["elements"] == 1000
+    assert estimate["forcing"]["bytes"] == 13 * 10 * 20 * 4
+    assert estimate["forcing"]["folder"][0]["covered"] and estimate["refused"] == []
+    sim_vars["end_t"] = "2024-06-03 12:00:00"
+    estimate = plan_run(sim_vars, {"folder": str(tmp_path), "copernicus": True, "border": [56, 59, 21, 25]},
+                        limits={"download_gb": 0.01})
+    assert len(estimate["forcing"]["folder"][0]["gaps"]) == 1 and len(estimate["warnings"]) == 1
+    assert estimate["refused"] and estimate["refused"][0].startswith("download_gb")
+
+def test_memory_reader():
+    rng = np.random.default_rng(0)
+    uo = rng.random((6, 30, 40)).astype("float32")
+    uo[:, 10:15, 10:20] = np.nan
+    ds = xr.Dataset({"uo": (("time", "latitude", "longitude"), uo),
+                     "vo": (("time", "latitude", "longitude"), rng.random((6, 30, 40)).astype("float32")),
+                     "thetao": (("time", "latitude", "longitude"), rng.random((6, 30, 40)).astype("float32"),
+                                {"standard_name": "sea_water_potential_temperature"})},
+                    coords={"time": pd.date_range("2024-06-01", periods=6, freq="h"),
+                            "latitude": np.linspace(56, 59, 30), "longitude": np.linspace(21, 25, 40)})
+    std_names = {"uo": "x_sea_water_velocity", "vo": "y_sea_water_velocity"}
+    lon, lat = rng.uniform(21.5, 24.5, 500), rng.uniform(56.5, 58.5, 500)
+    variables = ["x_sea_water_velocity", "y_sea_water_velocity"]
+    t = datetime.datetime(2024, 6, 1, 2, 20)
+    memory = create_readers([ds], std_names, "2024-06-01", "2024-06-01 05:00")[0]
+    assert isinstance(memory, MemoryReader)
+    env, _ = memory.get_variables_interpolated(variables, time=t, lon=lon, lat=lat, z=np.zeros(500))
+    ref, _ = Reader(ds, standard_name_mapping=std_names).get_variables_interpolated(
+        variables, time=t, lon=lon, lat=lat, z=np.zeros(500))
+    for var in variables:
+        assert np.allclose(env[var], ref[var], atol=1e-5)
+    assert isinstance(create_readers([ds], std_names, threshold=1e-6)[0], Reader)
+    # Variables the model does not request are neither loaded nor counted
+    required = create_readers([ds], std_names, threshold=7e-5, variables=variables)[0]
+    assert isinstance(required, MemoryReader) and sorted(required.field_of) == variables
+    assert isinstance(create_readers([ds], std_names, threshold=7e-5)[0], Reader)
@@ -0,0 +1,128 @@
+import itertools
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+# Particle-aware subsetting of forcing datasets.
+# Data variables are wrapped in lazy arrays that load only tiles covering the
+# block requested by the reader (particle bounding box) plus a safety margin of
+# max_speed * lookahead. Loaded tiles stay in memory, so the loaded area grows
+# with the particle cloud instead of covering the whole border from the start.
+TILE_SIZE = 32              # grid cells per spatial tile side
+TIME_TILE = 24              # time steps per tile
+MAX_SPEED = 2.0             # m/s, upper bound of drift speed
+LOOKAHEAD = 6 * 3600        # s
+DIMS = {'time': ['time', 'valid_time'],
+        'y': ['latitude', 'lat', 'y', 'rlat'],
+        'x': ['longitude', 'lon', 'x', 'rlon']}
+DEGREE = 111320             # m per degree of latitude
+
+
+class TileCache:
+    def __init__(self):
+        self.tiles = {}
+        self.loaded_bytes = 0
+
+    def get(self, key, load):
+        if key not in self.tiles:
+            tile = load()
+            self.tiles[key] = tile
+            self.loaded_bytes += tile.nbytes
+        return self.tiles[key]
+
+
+class TiledArray(BackendArray):
+    def __init__(self, name, variable, tiles, margin, cache):
+        self.name = name
+        self.variable = variable
+        self.shape = variable.shape
+        self.dtype = variable.dtype
+        self.tiles = tiles          # tile size per axis
+        self.margin = margin        # margin in cells per axis
+        self.cache = cache
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key):
+        indices = [np.atleast_1d(np.arange(n)[k]) for k, n in zip(key, self.shape)]
+        if any(len(ind) == 0 for ind in indices):
+            return np.empty([len(ind) for ind, k in zip(indices, key) if not isinstance(k, (int, np.integer))],
+                            dtype=self.dtype)
+
+        # Tiles covering the request, and the margin around it (prefetched)
+        requested = [range(ind.min() // t, ind.max() // t + 1) for ind, t in zip(indices, self.tiles)]
+        prefetch = [range(max(0, ind.min() - m) // t, min(n - 1, ind.max() + m) // t + 1)
+                    for ind, t, m, n in zip(indices, self.tiles, self.margin, self.shape)]
+        for tile in itertools.product(*prefetch):
+            self._tile(tile)
+
+        # Assemble block from requested tiles and index into it
+        start = [r.start * t for r, t in zip(requested, self.tiles)]
+        stop = [min(r.stop * t, n) for r, t, n in zip(requested, self.tiles, self.shape)]
+        block = np.empty([b - a for a, b in zip(start, stop)], dtype=self.dtype)
+        for tile in itertools.product(*requested):
+            data = self._tile(tile)
+            dest = tuple(slice(i * t - a, i * t - a + s) for i, t, a, s in zip(tile, self.tiles, start, data.shape))
+            block[dest] = data
+        local = np.ix_(*[ind - a for ind, a in zip(indices, start)])
+        result = block[local]
+        squeeze = tuple(axis for axis, k in enumerate(key) if isinstance(k, (int, np.integer)))
+        return result.squeeze(axis=squeeze) if squeeze else result
+
+    def _tile(self, tile):
+        slices = tuple(slice(i * t, min((i + 1) * t, n)) for i, t, n in zip(tile, self.tiles, self.shape))
+        return self.cache.get((self.name, tile), lambda: np.asarray(self.variable[slices].values))
+
+
+def dim_kind(dim):
+    for kind, names in DIMS.items():
+        if dim in names:
+            return kind
+    return None
+
+
+def cell_margin(ds, dim, kind, max_speed, lookahead):
+    if dim not in ds.coords or ds[dim].ndim != 1 or ds.sizes[dim] < 2:
+        return 0
+    values = ds[dim].values
+    if kind == 'time':
+        step = np.abs(np.median(np.diff(values))) / np.timedelta64(1, 's')
+        return int(np.ceil(lookahead / step))
+    step = np.abs(np.median(np.diff(values)))
+    if 'degree' in str(ds[dim].attrs.get('units', 'degree')):
+        step = step * DEGREE
+        if kind == 'x':
+            lat = [d for d in DIMS['y'] if d in ds.coords]
+            if lat:
+                step = step * np.cos(np.radians(np.nanmean(ds[lat[0]].values)))
+    return int(np.ceil(max_speed * lookahead / step))
+
+
+def tiled_dataset(ds, cache, max_speed=MAX_SPEED, lookahead=LOOKAHEAD, tile_size=TILE_SIZE):
+    if not isinstance(ds, xr.Dataset):
+        return ds
+    tile_sizes = {'time': TIME_TILE, 'y': tile_size, 'x': tile_size}
+    variables = {}
+    for name, var in ds.data_vars.items():
+        kinds = [dim_kind(dim) for dim in var.dims]
+        if 'x' not in kinds or 'y' not in kinds:
+            variables[name] = var.variable
+            continue
+        tiles = [tile_sizes[k] if k is not None else n for k, n in zip(kinds, var.shape)]
+        margin = [cell_margin(ds, dim, k, max_speed, lookahead) if k is not None else 0
+                  for dim, k in zip(var.dims, kinds)]
+        data = indexing.LazilyIndexedArray(TiledArray(f'{id(ds)}/{name}', var.variable, tiles, margin, cache))
+        variables[name] = xr.Variable(var.dims, data, attrs=var.attrs, encoding=var.encoding)
+    return xr.Dataset(variables, coords=ds.coords, attrs=ds.attrs)
+
+
+def tile_datasets(datasets, max_speed=MAX_SPEED, lookahead=LOOKAHEAD, tile_size=TILE_SIZE, cache=None):
+    # Datasets may be given as single dataset, list of datasets or list of lists
+    if cache is None:
+        cache = TileCache()
+    if isinstance(datasets, list):
+        return [tile_datasets(ds, max_speed, lookahead, tile_size, cache)[0] for ds in datasets], cache
+    return tiled_dataset(datasets, cache, max_speed, lookahead, tile_size), cache